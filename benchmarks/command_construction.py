@@ -0,0 +1,74 @@
+"""
+Micro-benchmark: cost of building a Command (template lookup) and rendering it.
+
+Compares the shared Jinja environment used by Command with the previous
+behaviour, in which every Command created its own Environment and recompiled
+the template. Also measures the cold start (first load of every template in a
+new environment) with and without the precompiled template modules.
+
+Usage: python -m benchmarks.command_construction [repetitions]
+"""
+import glob
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+from jinja2 import Environment, FileSystemLoader
+
+from vmm_manager.infra import command
+from vmm_manager.infra.command import Command
+
+DIR_TEMPLATES = os.path.join(os.path.dirname(command.__file__), '../includes/ps_templates')
+ARGS_COMANDO = {'vmm_server': 'vmm.domain.com', 'vm_id': '0000', 'lockfile': 'lock'}
+
+
+def construir_ambiente_por_comando():
+    ambiente = Environment(loader=FileSystemLoader(DIR_TEMPLATES), trim_blocks=True)
+    return ambiente.get_template('remove_operation_lock.j2')
+
+
+def construir_comando():
+    return Command('remove_operation_lock', **ARGS_COMANDO)
+
+
+def medir(descricao, funcao, repeticoes):
+    funcao()  # aquecimento: compilação inicial e cache de bytecode
+    tempo = timeit.timeit(funcao, number=repeticoes)
+    print(f'{descricao:<40} {tempo / repeticoes * 1e6:>10.1f} us/command')
+    return tempo
+
+
+def medir_carga_inicial(descricao, pasta_templates_compilados=None):
+    # Sem cache de bytecode em disco, como na primeira execução
+    nomes = [os.path.basename(arquivo) for arquivo in glob.glob(os.path.join(DIR_TEMPLATES, '*.j2'))]
+    ambiente = Command.criar_ambiente_jinja(pasta_templates_compilados)
+    ambiente.bytecode_cache = None
+
+    inicio = time.perf_counter()
+    for nome in nomes:
+        ambiente.get_template(nome)
+    print(f'{descricao:<40} {(time.perf_counter() - inicio) * 1e3:>10.1f} ms ({len(nomes)} templates)')
+
+
+def main():
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    tempo_antes = medir('Environment per command (before)',
+                        construir_ambiente_por_comando, repeticoes)
+    tempo_depois = medir('Shared environment (after)',
+                         construir_comando, repeticoes)
+    medir('Shared environment + render',
+          lambda: construir_comando().renderizar(), repeticoes)
+
+    print(f'Speed-up: {tempo_antes / tempo_depois:.1f}x')
+
+    medir_carga_inicial('Cold start, live Jinja compilation')
+    with tempfile.TemporaryDirectory() as pasta_templates_compilados:
+        Command.precompilar_templates(pasta_templates_compilados)
+        medir_carga_inicial('Cold start, precompiled modules', pasta_templates_compilados)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark: growth of the remote inventory scripts with the size of the data.
+
+Renders the inventory templates and walks their loops, without PowerShell:
+each collection built inside a loop is classified by how it grows.
+
+- `$lista += $item` on an array (`@()`) copies the whole array on every
+  append: n(n+1)/2 element copies for n items (quadratic);
+- `$lista.Add($item)` on a generic List appends in place: n copies (linear).
+
+The loops are mapped to a simulated data size (VMs of the group, disks and
+networks of each VM, hosts of the VMM) and the element copies of every
+collection are added up, so changes in the complexity of the scripts show up
+as changes in this table.
+
+Usage: python -m benchmarks.template_complexity [vms_of_the_group ...]
+"""
+import re
+import sys
+
+from vmm_manager.infra.command import Command
+
+TEMPLATES = {
+    'get_inventory_snapshot': {'dados_completos': True},
+    'get_inventory_fingerprint': {'dados_completos': True},
+    'get_available_regions': {},
+}
+ARGS_COMANDO = {'vmm_server': 'vmm', 'cloud': 'cloud', 'group': 'group',
+                'field_group': 'group', 'field_id': 'id', 'field_image': 'image',
+                'field_region': 'region', 'field_network_default': 'network'}
+
+QTDES_VMS = [100, 1000, 5000]
+QTDE_HOSTS = 50
+DISCOS_POR_VM = 4
+REDES_POR_VM = 2
+
+# Coleção percorrida pelo foreach -> dimensão dos dados
+DIMENSOES_LOOP = [
+    (re.compile(r'\$vms_grupo\b'), 'vms'),
+    (re.compile(r'VirtualDiskDrives'), 'disks'),
+    (re.compile(r'VirtualNetworkAdapters'), 'networks'),
+    (re.compile(r'\$hosts_cluster\b'), 'hosts'),
+]
+
+REGEX_FOREACH = re.compile(r'^\s*foreach\s*\(\s*\$\w+\s+in\s+(.+?)\)\s*\{')
+REGEX_ARRAY = re.compile(r'^\s*\$(\w+)\s*=\s*@\(\)\s*$')
+REGEX_APPEND_ARRAY = re.compile(r'^\s*\$(\w+)\s*\+=')
+REGEX_APPEND_LISTA = re.compile(r'^\s*\$(\w+)\.Add\(')
+
+
+def get_dimensao(colecao):
+    for regex, dimensao in DIMENSOES_LOOP:
+        if regex.search(colecao):
+            return dimensao
+    return None
+
+
+def analisar(conteudo):
+    # [(coleção, dimensões dos loops envolventes, quadrática?)]
+    arrays = set()
+    loops = []  # (profundidade de chaves ao abrir, dimensão)
+    profundidade = 0
+    inclusoes = []
+
+    for linha in conteudo.splitlines():
+        foreach = REGEX_FOREACH.match(linha)
+        if foreach:
+            loops.append((profundidade, get_dimensao(foreach.group(1))))
+
+        array = REGEX_ARRAY.match(linha)
+        if array:
+            arrays.add(array.group(1))
+
+        dimensoes = tuple(dimensao for _, dimensao in loops if dimensao)
+        append_array = REGEX_APPEND_ARRAY.match(linha)
+        append_lista = REGEX_APPEND_LISTA.match(linha)
+        if append_array and append_array.group(1) in arrays and dimensoes:
+            inclusoes.append((append_array.group(1), dimensoes, True))
+        elif append_lista and dimensoes:
+            inclusoes.append((append_lista.group(1), dimensoes, False))
+
+        profundidade += linha.count('{') - linha.count('}')
+        while loops and profundidade <= loops[-1][0]:
+            loops.pop()
+
+    return inclusoes
+
+
+def contar_copias(inclusoes, tamanhos):
+    total = 0
+    for _, dimensoes, quadratica in inclusoes:
+        repeticoes = 1
+        for dimensao in dimensoes[:-1]:
+            repeticoes *= tamanhos[dimensao]
+        qtde_itens = tamanhos[dimensoes[-1]]
+        copias = qtde_itens * (qtde_itens + 1) // 2 if quadratica else qtde_itens
+        total += repeticoes * copias
+    return total
+
+
+def main():
+    qtdes_vms = [int(qtde) for qtde in sys.argv[1:]] or QTDES_VMS
+
+    print(f'Simulated data: {QTDE_HOSTS} hosts, {DISCOS_POR_VM} disks '
+          f'and {REDES_POR_VM} networks per VM')
+    for template, args_template in TEMPLATES.items():
+        inclusoes = analisar(Command(template, **ARGS_COMANDO, **args_template).renderizar())
+
+        print(f'\n{template}')
+        for colecao, dimensoes, quadratica in inclusoes:
+            print(f"  ${colecao:<12} per {' x '.join(dimensoes):<14} "
+                  f"{'quadratic (+= on array)' if quadratica else 'linear (List.Add)'}")
+        for qtde_vms in qtdes_vms:
+            tamanhos = {'vms': qtde_vms, 'hosts': QTDE_HOSTS,
+                        'disks': DISCOS_POR_VM, 'networks': REDES_POR_VM}
+            print(f'  {qtde_vms:>6} VMs: {contar_copias(inclusoes, tamanhos):>14,} element copies')
+
+
+if __name__ == '__main__':
+    main()
@@ -79,6 +79,7 @@ class Base():
                         randint(Base.CPU_MIN, Base.CPU_MAX),
                         randint(Base.RAM_MIN, Base.RAM_MAX),
                         redes_vm,
+                        vmm_id=str(uuid.uuid4()),
                         nested_virtualization=bool(getrandbits(1)),
                         dynamic_memory=bool(getrandbits(1)),
                         region_host=inventario.get_nome_no_regiao(regiao_vm))
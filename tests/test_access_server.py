@@ -0,0 +1,387 @@
+"""
+Testes do AccessServer
+"""
+import base64
+import io
+import json
+import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from vmm_manager.infra.access_server import AccessServer
+from vmm_manager.infra.powershell_session import PowerShellSession
+from vmm_manager.util.timing import ServerTimingFilter, TimingReport
+
+
+class TestAccessServer:
+
+    @staticmethod
+    def get_canal_mock(mocker, saida='', erro='', status_saida=0, tamanho_bloco=4):
+        def get_blocos(texto):
+            dados = texto.encode('cp850')
+            return [dados[inicio:inicio + tamanho_bloco]
+                    for inicio in range(0, len(dados), tamanho_bloco)] + [b'']
+
+        stdout = mocker.Mock()
+        stdout.channel.recv.side_effect = get_blocos(saida)
+        stdout.channel.recv_stderr.side_effect = get_blocos(erro)
+        stdout.channel.recv_exit_status.return_value = status_saida
+        return mocker.Mock(), stdout, mocker.Mock()
+
+    @staticmethod
+    def get_resposta_sessao(stdout='', stderr=''):
+        resposta = base64.b64encode(json.dumps(
+            {'Stdout': stdout, 'Stderr': stderr}).encode('utf-8'))
+        return f'{len(resposta)}\n'.encode('ascii') + resposta + b'\n'
+
+    @pytest.fixture
+    def ssh_client(self, mocker):
+        classe_ssh_client = mocker.patch(
+            'vmm_manager.infra.access_server.paramiko.SSHClient')
+        cliente = classe_ssh_client.return_value
+        cliente.get_transport.return_value.is_active.return_value = True
+        cliente.open_sftp.return_value.get_channel.return_value.closed = False
+        cliente.exec_command.side_effect = lambda *_args, **_kwargs: \
+            TestAccessServer.get_canal_mock(mocker, 'OK')
+        return classe_ssh_client
+
+    def test_conexao_reutilizada_entre_scripts(self, ssh_client):
+        sftp = ssh_client.return_value.open_sftp.return_value
+        sftp.stat.side_effect = FileNotFoundError
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm',
+                                       AccessServer.MODO_ARQUIVO)
+
+        for _ in range(5):
+            status, saida = servidor_acesso.executar_script(
+                'script', 'Write-Host OK')
+            assert status is True
+            assert saida == 'OK'
+
+        assert servidor_acesso.qtde_handshakes == 1
+        assert ssh_client.return_value.connect.call_count == 1
+        assert ssh_client.return_value.open_sftp.call_count == 1
+        # Scripts sem parâmetros são excluídos após a execução
+        assert sftp.putfo.call_count == 5
+        assert [chamada.args[0] for chamada in sftp.remove.call_args_list] == \
+            [chamada.args[1] for chamada in sftp.putfo.call_args_list]
+
+    def test_reconexao_apos_falha_transporte(self, ssh_client):
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm')
+
+        transporte = ssh_client.return_value.get_transport.return_value
+
+        servidor_acesso.executar_script('script', 'Write-Host OK')
+
+        # Transporte caiu: a próxima conexão volta a ficar ativa
+        transporte.is_active.return_value = False
+        ssh_client.return_value.connect.side_effect = \
+            lambda **_kwargs: setattr(transporte.is_active, 'return_value', True)
+        servidor_acesso.executar_script('script', 'Write-Host OK')
+
+        assert servidor_acesso.qtde_handshakes == 2
+
+    def test_script_enviado_por_stdin(self, ssh_client):
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm')
+
+        for _ in range(3):
+            status, _ = servidor_acesso.executar_script(
+                'script', 'Write-Host "Olá"')
+            assert status is True
+
+        # Pasta temporária criada uma vez e um comando por script
+        assert ssh_client.return_value.exec_command.call_count == 4
+        assert ssh_client.return_value.open_sftp.call_count == 0
+
+    def test_script_stdin_codificado(self, ssh_client, mocker):
+        canal = TestAccessServer.get_canal_mock(mocker, 'OK')
+        ssh_client.return_value.exec_command.side_effect = [
+            TestAccessServer.get_canal_mock(mocker),  # pasta temporária
+            canal]
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm')
+
+        servidor_acesso.executar_script('script', 'Write-Host "Olá"')
+
+        conteudo_enviado = canal[0].write.call_args.args[0]
+        assert base64.b64decode(conteudo_enviado).decode('utf-8') == 'Write-Host "Olá"'
+        canal[1].channel.shutdown_write.assert_called_once()
+
+    def test_corpo_fixo_enviado_uma_vez(self, ssh_client):
+        sftp = ssh_client.return_value.open_sftp.return_value
+        sftp.stat.side_effect = FileNotFoundError
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm',
+                                       AccessServer.MODO_ARQUIVO)
+
+        for num in range(3):
+            status, _ = servidor_acesso.executar_script(
+                'script', 'Write-Host $parametros.vm_name', parametros={'vm_name': f'VM0{num}'})
+            assert status is True
+
+        # Corpo enviado uma única vez e mantido; parâmetros na linha de comando
+        assert sftp.putfo.call_count == 1
+        sftp.remove.assert_not_called()
+        cmd = ssh_client.return_value.exec_command.call_args.args[0]
+        parametros_codificados = re.search(r"FromBase64String\('([^']+)'\)", cmd)
+        assert json.loads(base64.b64decode(parametros_codificados.group(1))) == {'vm_name': 'VM02'}
+        assert sftp.putfo.call_args.args[1] in cmd
+
+    def test_corpo_fixo_stdin_reutilizado_do_cache(self, ssh_client):
+        sftp = ssh_client.return_value.open_sftp.return_value
+        sftp.stat.side_effect = FileNotFoundError
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm')
+
+        for num in range(3):
+            status, _ = servidor_acesso.executar_script(
+                'script', 'Write-Host $parametros.vm_name', parametros={'vm_name': f'VM0{num}'})
+            assert status is True
+
+        # Primeira execução por stdin; as seguintes usam o corpo enviado uma única vez
+        comandos = [call.args[0] for call in ssh_client.return_value.exec_command.call_args_list[1:]]
+        assert 'FromBase64String([Console]::In.ReadToEnd())' in comandos[0]
+        assert all(sftp.putfo.call_args.args[1] in cmd for cmd in comandos[1:])
+        assert sftp.putfo.call_count == 1
+
+    def test_sessao_reutilizada_entre_scripts(self, ssh_client):
+        canal = ssh_client.return_value.get_transport.return_value.open_session.return_value
+        canal.closed = False
+        canal.exit_status_ready.return_value = False
+        canal.recv_stderr.return_value = b''
+        canal.makefile.return_value = io.BytesIO(
+            TestAccessServer.get_resposta_sessao()
+            + TestAccessServer.get_resposta_sessao('OK 1')
+            + TestAccessServer.get_resposta_sessao(stderr='Falha'))
+        entrada = io.BytesIO()
+        entrada.close = lambda: None
+        canal.makefile_stdin.return_value = entrada
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm',
+                                       AccessServer.MODO_SESSAO)
+
+        assert servidor_acesso.executar_script(
+            'script', 'Write-Host 1', parametros={'num': 1}) == (True, 'OK 1')
+        assert servidor_acesso.executar_script(
+            'script', 'Write-Host 1', parametros={'num': 2}) == (False, 'Falha')
+
+        assert canal.exec_command.call_count == 1
+        cabecalho, conteudo, parametros, cabecalho_cache, conteudo_cache, parametros_cache, _ = \
+            entrada.getvalue().split(b'\n', 6)
+        tamanho, hash_script = cabecalho.split(b' ')
+        assert int(tamanho) == len(conteudo)
+        assert base64.b64decode(conteudo).decode('utf-8') == 'Write-Host 1'
+        assert json.loads(base64.b64decode(parametros)) == {'num': 1}
+        # Corpo repetido: apenas o hash e os parâmetros são reenviados
+        assert cabecalho_cache == b'0 ' + hash_script
+        assert conteudo_cache == b''
+        assert json.loads(base64.b64decode(parametros_cache)) == {'num': 2}
+
+    def test_sessao_descartada_apos_resposta_invalida(self, ssh_client, mocker):
+        canais = []
+
+        def open_session():
+            canal = mocker.MagicMock()
+            canal.closed = False
+            canal.exit_status_ready.return_value = False
+            canal.close.side_effect = lambda: setattr(canal, 'closed', True)
+            canal.recv_stderr.return_value = b''
+            # Resposta da inicialização e, em seguida, um quadro malformado
+            canal.makefile.return_value = io.BytesIO(
+                TestAccessServer.get_resposta_sessao() + b'8\n!!!!!!!!\n')
+            canal.makefile_stdin.return_value = io.BytesIO()
+            canais.append(canal)
+            return canal
+
+        ssh_client.return_value.get_transport.return_value.open_session.side_effect = open_session
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm',
+                                       AccessServer.MODO_SESSAO)
+
+        for _ in range(2):
+            status, msg = servidor_acesso.executar_script('script', 'Write-Host 1')
+            assert status is False
+            assert msg.startswith('Error in the PowerShell session')
+
+        # A sessão dessincronizada não é reaproveitada
+        assert len(canais) == 2
+        assert all(canal.closed for canal in canais)
+
+    def test_sessao_descartada_apos_timeout(self, ssh_client):
+        canal = ssh_client.return_value.get_transport.return_value.open_session.return_value
+        canal.closed = False
+        canal.exit_status_ready.return_value = False
+        canal.close.side_effect = lambda: setattr(canal, 'closed', True)
+        erro_drenado = threading.Event()
+        erros = [b'Aviso do worker']
+
+        def recv_stderr(*_args):
+            if not erros:
+                erro_drenado.set()
+                return b''
+            return erros.pop(0)
+
+        canal.recv_stderr.side_effect = recv_stderr
+        saida = io.BytesIO(TestAccessServer.get_resposta_sessao())
+        leituras = [saida.readline, saida.readline]
+
+        def readline(*_args):
+            if leituras:
+                return leituras.pop(0)()
+            # Sem resposta do worker dentro do timeout do canal
+            erro_drenado.wait(5)
+            raise socket.timeout('timed out')
+
+        canal.makefile.return_value.readline.side_effect = readline
+        canal.makefile.return_value.read.side_effect = saida.read
+        canal.makefile_stdin.return_value = io.BytesIO()
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm',
+                                       AccessServer.MODO_SESSAO)
+
+        status, msg = servidor_acesso.executar_script('script', 'Write-Host 1')
+
+        assert status is False
+        assert 'timed out' in msg
+        assert 'Aviso do worker' in msg
+        canal.settimeout.assert_called_once_with(AccessServer.TIMEOUT_SESSAO)
+        assert canal.closed
+
+    def test_sessao_com_cache_limitado(self, ssh_client, mocker):
+        mocker.patch.object(PowerShellSession, 'MAX_SCRIPTS_EM_CACHE', 2)
+        canal = ssh_client.return_value.get_transport.return_value.open_session.return_value
+        canal.closed = False
+        canal.exit_status_ready.return_value = False
+        canal.recv_stderr.return_value = b''
+        canal.makefile.return_value = io.BytesIO(
+            TestAccessServer.get_resposta_sessao('OK') * 6)
+        entrada = io.BytesIO()
+        entrada.close = lambda: None
+        canal.makefile_stdin.return_value = entrada
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm',
+                                       AccessServer.MODO_SESSAO)
+
+        for corpo in ['Write-Host 1', 'Write-Host 2', 'Write-Host 3', 'Write-Host 1']:
+            servidor_acesso.executar_script('script', corpo, parametros={})
+        # Sem parâmetros, o script não é guardado na sessão
+        servidor_acesso.executar_script('script', 'Write-Host 4')
+
+        linhas = entrada.getvalue().split(b'\n')
+        cabecalhos = [linha.split(b' ') for linha in linhas[0:-1:3]]
+        # O corpo 1 foi descartado ao guardar o 3 e é reenviado inteiro
+        assert [int(tamanho) > 0 for tamanho, _ in cabecalhos] == [True] * 5
+        assert cabecalhos[-1][1] == b'-'
+        # O worker aplica o mesmo limite
+        worker = base64.b64decode(canal.exec_command.call_args.args[0].split()[-1]).decode('utf-16-le')
+        assert '$ordem_scripts.Count -gt 2' in worker
+
+    def test_script_em_cache_no_servidor(self, ssh_client):
+        sftp = ssh_client.return_value.open_sftp.return_value
+        sftp.stat.return_value.st_size = len('Write-Host OK')
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm',
+                                       AccessServer.MODO_ARQUIVO)
+
+        servidor_acesso.executar_script('script', 'Write-Host OK', parametros={})
+
+        caminho_script = sftp.stat.call_args.args[0]
+        assert caminho_script.endswith('.ps1')
+        sftp.putfo.assert_not_called()
+
+    def test_canais_concorrentes_limitados(self, ssh_client, mocker):
+        max_canais = 3
+        lock = threading.Lock()
+        em_execucao = [0, 0]  # atual, máximo
+
+        def exec_command(*_args, **_kwargs):
+            with lock:
+                em_execucao[0] += 1
+                em_execucao[1] = max(em_execucao[1], em_execucao[0])
+            time.sleep(0.01)
+            with lock:
+                em_execucao[0] -= 1
+            return TestAccessServer.get_canal_mock(mocker, 'OK')
+
+        ssh_client.return_value.exec_command.side_effect = exec_command
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm',
+                                       max_canais=max_canais)
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            resultados = list(executor.map(
+                lambda num: servidor_acesso.executar_script(f'script{num}', 'Write-Host OK'),
+                range(30)))
+
+        assert all(status for status, _ in resultados)
+        assert em_execucao[1] <= max_canais
+        assert servidor_acesso.qtde_handshakes == 1
+
+    def test_saida_e_erro_drenados(self, ssh_client, mocker):
+        ssh_client.return_value.exec_command.side_effect = [
+            TestAccessServer.get_canal_mock(mocker),  # pasta temporária
+            TestAccessServer.get_canal_mock(mocker, 'saída longa ' * 100, 'Erro: ação inválida')]
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm')
+
+        status, msg = servidor_acesso.executar_script('script', 'Write-Host OK')
+
+        assert status is False
+        assert msg == 'Erro: ação inválida'
+
+    def test_erro_limitado(self, ssh_client, mocker):
+        mocker.patch.object(AccessServer, 'TAMANHO_MAXIMO_ERRO', 10)
+        ssh_client.return_value.exec_command.side_effect = [
+            TestAccessServer.get_canal_mock(mocker),  # pasta temporária
+            TestAccessServer.get_canal_mock(mocker, 'OK', 'Erro: ' + 'x' * 100)]
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm')
+
+        status, msg = servidor_acesso.executar_script('script', 'Write-Host OK')
+
+        assert status is False
+        assert msg == 'Erro: xxxx\n[96 characters of stderr truncated]'
+
+    @pytest.mark.parametrize('medir_tempos', [False, True])
+    def test_saida_sem_consumidor_limitada(self, ssh_client, mocker, medir_tempos):
+        mocker.patch.object(AccessServer, 'TAMANHO_MAXIMO_SAIDA', 100)
+        saida = 'saída ' * 100
+        canal = TestAccessServer.get_canal_mock(mocker, saida)
+        ssh_client.return_value.exec_command.side_effect = [
+            TestAccessServer.get_canal_mock(mocker),  # pasta temporária
+            canal]
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm',
+                                       relatorio_tempos=TimingReport() if medir_tempos else None)
+
+        status, msg = servidor_acesso.executar_script('script', 'Write-Host OK')
+
+        assert status is False
+        assert 'exceeded 100 characters' in msg
+        # O canal foi drenado até o fim, mesmo com o excedente descartado
+        assert canal[1].channel.recv.call_count == len(saida.encode('cp850')) // 4 + 1
+
+    def test_saida_entregue_em_partes(self, ssh_client, mocker):
+        saida = 'conteúdo ' * 50
+        ssh_client.return_value.exec_command.side_effect = [
+            TestAccessServer.get_canal_mock(mocker),  # pasta temporária
+            TestAccessServer.get_canal_mock(mocker, saida)]
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm')
+        partes = []
+
+        status, retorno = servidor_acesso.executar_script(
+            'script', 'Write-Host OK', ao_receber_saida=partes.append)
+
+        assert status is True
+        assert retorno == ''
+        assert len(partes) > 1
+        assert ''.join(partes) == saida
+
+    def test_tempos_por_comando(self, ssh_client, mocker):
+        ssh_client.return_value.exec_command.side_effect = [
+            TestAccessServer.get_canal_mock(mocker),  # pasta temporária
+            TestAccessServer.get_canal_mock(
+                mocker, f'OK\r\n\n{ServerTimingFilter.MARCADOR}250\r\n')]
+        relatorio_tempos = TimingReport()
+        servidor_acesso = AccessServer('host', 'user', 'pass', 'vmm',
+                                       relatorio_tempos=relatorio_tempos)
+
+        status, saida = servidor_acesso.executar_script('script', 'Write-Host OK')
+
+        assert status is True
+        assert saida.strip() == 'OK'
+        dados = relatorio_tempos.get_dados()
+        assert [item['command'] for item in dados] == ['script']
+        assert dados[0]['server'] == 250.0
+        assert dados[0]['exec'] > 0
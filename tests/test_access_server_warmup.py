@@ -0,0 +1,84 @@
+"""
+Testes do AccessServerWarmup
+"""
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from vmm_manager.infra.access_server_warmup import AccessServerWarmup
+
+
+class TestAccessServerWarmup:
+
+    def test_etapas_executadas_em_segundo_plano(self):
+        liberar = threading.Event()
+        executadas = []
+
+        def etapa(nome):
+            liberar.wait(timeout=5)
+            executadas.append(nome)
+            return True, ''
+
+        preparacao = AccessServerWarmup([('Etapa 1', lambda: etapa(1)),
+                                         ('Etapa 2', lambda: etapa(2))])
+
+        # O chamador segue enquanto as etapas aguardam
+        assert not executadas
+        liberar.set()
+        preparacao.aguardar(True)
+        preparacao.aguardar(True)
+
+        assert executadas == [1, 2]
+
+    def test_falha_interrompe_etapas(self):
+        executadas = []
+
+        def etapa(nome, status):
+            executadas.append(nome)
+            return status, f'Falha na etapa {nome}'
+
+        preparacao = AccessServerWarmup([('Etapa 1', lambda: etapa(1, False)),
+                                         ('Etapa 2', lambda: etapa(2, True))])
+
+        with pytest.raises(SystemExit):
+            preparacao.aguardar(True)
+        assert executadas == [1]
+
+    def test_cancelamento_interrompe_etapas_seguintes(self):
+        liberar = threading.Event()
+        executadas = []
+
+        def etapa(nome):
+            liberar.wait(timeout=5)
+            executadas.append(nome)
+            return True, ''
+
+        preparacao = AccessServerWarmup([('Etapa 1', lambda: etapa(1)),
+                                         ('Etapa 2', lambda: etapa(2))])
+
+        assert preparacao.is_em_andamento()
+        preparacao.cancelar()
+        liberar.set()
+        preparacao.aguardar(True)
+
+        assert executadas == [1]
+        assert not preparacao.is_em_andamento()
+
+    def test_saida_antecipada_nao_aguarda_etapa_lenta(self):
+        # Etapa lenta (ex.: conexão SSH) seguida de sys.exit, como numa falha
+        # de validação do inventário local
+        script = (
+            'import sys, time\n'
+            'from vmm_manager.infra.access_server_warmup import AccessServerWarmup\n'
+            "preparacao = AccessServerWarmup([('Etapa', lambda: time.sleep(60) or (True, ''))])\n"
+            'preparacao.cancelar()\n'
+            'sys.exit(1)\n')
+
+        inicio = time.monotonic()
+        processo = subprocess.run([sys.executable, '-c', script], timeout=30, check=False)
+
+        assert processo.returncode == 1
+        assert time.monotonic() - inicio < 30
@@ -0,0 +1,160 @@
+"""
+Testes do Command e do CommandBatch
+"""
+import base64
+import json
+import re
+
+import pytest
+
+from vmm_manager.infra.command import Command, CommandBatch
+
+
+class TestCommand:
+
+    @staticmethod
+    def get_comandos(qtde):
+        return [Command('remove_operation_lock', lockfile=f'lock_{num}')
+                for num in range(qtde)]
+
+    def test_lote_renderiza_todos_os_comandos(self):
+        comandos = TestCommand.get_comandos(3)
+        conteudo_lote = CommandBatch(comandos).renderizar()
+
+        for cmd in comandos:
+            assert cmd.renderizar() in conteudo_lote
+        assert conteudo_lote.count('Invoke-VmmManagerBloco {') == 3
+
+    def test_lote_mapeia_resultados(self, servidor_acesso):
+        servidor_acesso.executar_script.return_value = True, json.dumps([
+            {'Stdout': 'OK 0', 'Stderr': ''},
+            {'Stdout': '', 'Stderr': 'Falha 1'},
+            {'Stdout': 'OK 2', 'Stderr': ''},
+        ])
+
+        resultados = CommandBatch(TestCommand.get_comandos(3)).executar(servidor_acesso)
+
+        assert resultados == [(True, 'OK 0'), (False, 'Falha 1'), (True, 'OK 2')]
+        servidor_acesso.executar_script.assert_called_once()
+
+    def test_lote_com_erro_de_execucao(self, servidor_acesso):
+        servidor_acesso.executar_script.return_value = False, 'Erro de conexão'
+
+        resultados = CommandBatch(TestCommand.get_comandos(2)).executar(servidor_acesso)
+
+        assert resultados == [(False, 'Erro de conexão')] * 2
+
+    @pytest.mark.parametrize('retorno', [
+        [{'Stdout': 'OK 0', 'Stderr': ''}],
+        {'Stdout': 'OK 0', 'Stderr': ''},
+    ])
+    def test_lote_com_resultados_faltando(self, servidor_acesso, retorno):
+        servidor_acesso.executar_script.return_value = True, json.dumps(retorno)
+
+        resultados = CommandBatch(TestCommand.get_comandos(3)).executar(servidor_acesso)
+
+        # Nenhum comando fica sem resultado: todos são dados como falhos
+        assert len(resultados) == 3
+        assert all(status is False and 'expected 3 results' in msg for status, msg in resultados)
+
+    def test_divisao_em_lotes(self):
+        lotes = CommandBatch.dividir_em_lotes(TestCommand.get_comandos(7), 3)
+
+        assert [len(lote.comandos) for lote in lotes] == [3, 3, 1]
+
+    def test_templates_precompilados(self, tmp_path):
+        Command.precompilar_templates(str(tmp_path))
+        ambiente_compilado = Command.criar_ambiente_jinja(str(tmp_path))
+        ambiente_templates = Command.criar_ambiente_jinja()
+        args = {'corpos': ['Write-Output 1'], 'lockfile': 'lock', 'vmm_server': 'vmm'}
+
+        for nome in ['command_batch.j2', 'remove_operation_lock.j2']:
+            template_compilado = ambiente_compilado.get_template(nome)
+            # Carregado do módulo gerado, sem o arquivo .j2
+            assert template_compilado.filename.endswith('.py')
+            assert template_compilado.render(args) == \
+                ambiente_templates.get_template(nome).render(args)
+        assert (tmp_path / 'templates.sha256').read_text() == Command.get_assinatura_templates()
+
+    def test_vm_localizada_pelo_prelude(self):
+        conteudo = Command('update_dynamic_memory', vmm_server='vmm', cloud='cloud',
+                           group='group', field_group='group_field', field_id='id_field',
+                           vm_name='VM01', vm_id='1234', dynamic_memory=True).renderizar()
+
+        assert 'function Get-VmmManagerVM' in conteudo
+        assert '$VM = Get-VmmManagerVM $parametros.vm_name $parametros.vm_id' in conteudo
+        assert '"cloud/group"' in conteudo
+        # Uma única varredura da nuvem, feita pelo índice
+        assert conteudo.count('Get-SCVirtualMachine -VMMServer "vmm" -Cloud') == 1
+        # O índice guarda só o ID: a VM é consultada de novo a cada ação do lote
+        assert '$indice[$campos["id_field"]] = $vm_obj.ID' in conteudo
+        assert 'return Get-SCVirtualMachine -VMMServer "vmm" -ID $indice[$Nome]' in conteudo
+
+    def test_corpo_fixo_com_parametros(self):
+        args_corpo = {'vmm_server': 'vmm', 'cloud': 'cloud', 'group': 'group',
+                      'field_group': 'group_field', 'field_id': 'id_field'}
+        comandos = [Command('create_vm_disk', **args_corpo, vm_name=f'VM0{num}', vm_id=None,
+                            bus_type='SCSI', size_mb=1024 * num, size_type='Dynamic',
+                            file=f'disco_{num}', path=None)
+                    for num in range(1, 3)]
+
+        # O corpo não muda entre as chamadas: só os parâmetros
+        assert comandos[0].renderizar_corpo() == comandos[1].renderizar_corpo()
+        assert 'VM01' not in comandos[0].renderizar_corpo()
+        assert comandos[1].get_parametros() == {
+            'vm_name': 'VM02', 'vm_id': None, 'bus_type': 'SCSI', 'size_mb': 2048,
+            'size_type': 'Dynamic', 'file': 'disco_2', 'path': None}
+
+        # O script completo define $parametros antes do corpo
+        linha_parametros, corpo = comandos[0].renderizar().split('\n', 1)
+        parametros_codificados = re.search(r"FromBase64String\('([^']+)'\)", linha_parametros)
+        assert json.loads(base64.b64decode(parametros_codificados.group(1))) == \
+            comandos[0].get_parametros()
+        assert corpo == comandos[0].renderizar_corpo()
+
+    def test_executar_com_parametros(self, servidor_acesso):
+        cmd = Command('delete_vm_disk', vmm_server='vmm', vm_id='1234', drive_id='5678')
+
+        cmd.executar(servidor_acesso)
+
+        servidor_acesso.executar_script.assert_called_once_with(
+            'delete_vm_disk', cmd.renderizar_corpo(), ao_receber_saida=None,
+            parametros={'vm_id': '1234', 'drive_id': '5678'})
+        # Comandos sem corpo fixo são enviados inteiros
+        assert Command('remove_operation_lock', lockfile='lock').get_parametros() is None
+
+    def test_consulta_vms_sem_chamada_por_vm(self):
+        conteudo = Command('get_inventory_snapshot', vmm_server='vmm', cloud='cloud',
+                           group='group', field_group='group_field', field_id='id_field',
+                           field_image='image_field', field_region='region_field',
+                           field_network_default='network_field',
+                           dados_completos=True).renderizar()
+
+        # Campos customizados lidos em lote, com filtro pelo grupo antes do processamento
+        assert 'Get-SCCustomPropertyValue' not in conteudo
+        assert '$_.CustomProperty["group_field"] -eq "group"' in conteudo
+        assert '$campos["image_field"]' in conteudo
+        # Discos na mesma consulta; as regiões só são consultadas quando usadas
+        assert '$vm.VirtualDiskDrives' in conteudo
+        assert 'Get-SCVMHost' not in conteudo
+
+    def test_versao_inclui_propriedades_customizadas(self):
+        conteudo = Command('get_inventory_fingerprint', vmm_server='vmm', cloud='cloud',
+                           group='group', field_group='group_field', field_id='id_field',
+                           field_image='image_field', field_region='region_field',
+                           field_network_default='network_field').renderizar()
+
+        # Set-SCCustomPropertyValue pode não alterar o ModifiedTime
+        for campo in ['group_field', 'id_field', 'image_field', 'region_field', 'network_field']:
+            assert f'$campos["{campo}"]' in conteudo
+        assert '$vm.ModifiedTime' in conteudo
+
+    @pytest.mark.parametrize('template', ['get_inventory_snapshot', 'get_inventory_fingerprint',
+                                          'get_available_regions'])
+    def test_consulta_sem_append_em_array(self, template):
+        conteudo = Command(template, vmm_server='vmm', cloud='cloud', group='group',
+                           dados_completos=True).renderizar()
+
+        # Coleções montadas com List.Add: += copia o array a cada inclusão
+        assert '= @()' not in conteudo
+        assert '.Add(' in conteudo
@@ -6,6 +6,7 @@ from random import randint
 
 from tests.base import Base
 from tests.utils import Utils
+from vmm_manager.entity.action import Action
 from vmm_manager.entity.plan import Plan
 from vmm_manager.scvmm.enums import SCDiskBusType, SCDiskSizeType
 
@@ -58,7 +59,7 @@ class TestComparisonInvDisk(Base):
         for vm_name in discos_removidos:
             for disco in discos_removidos[vm_name].values():
                 plano_execucao.actions.append(
-                    disco.get_acao_criar_disco(vm_name))
+                    disco.get_acao_criar_disco(vm_name, inventario.vms[vm_name].vmm_id))
 
         return plano_execucao
 
@@ -95,7 +96,7 @@ class TestComparisonInvDisk(Base):
                         )
                     )
                     plano_execucao.actions.append(
-                        disco.get_acao_criar_disco(vm_name))
+                        disco.get_acao_criar_disco(vm_name, inventario.vms[vm_name].vmm_id))
                 elif tipo_alteracao == TestComparisonInvDisk.TP_ALTERACAO_EXPANSAO:
                     plano_execucao.actions.append(
                         disco.get_acao_expandir_disco(
@@ -233,3 +234,21 @@ class TestComparisonInvDisk(Base):
             inventario_local,
             discos_alterados,
             self.TP_ALTERACAO_TP_TAMANHO)
+
+    def test_disco_recriado_em_vm_recriada(self):
+        inventario_local = Base.get_inventario_completo(
+            num_min_discos_por_vm=2)
+        inventario_remoto = copy.deepcopy(inventario_local)
+        self.alterar_discos_inventario(inventario_local, self.TP_ALTERACAO_TP_BUS)
+        for vm_obj in inventario_local.vms.values():
+            vm_obj.image = Utils.get_random_string_com_excecao(vm_obj.image)
+
+        status, plano_execucao = inventario_local.calcular_plano_execucao(
+            inventario_remoto)
+
+        # A VM recriada recebe um novo ID: o disco é criado na VM localizada pelo nome
+        acoes_criar_disco = [acao for acao in plano_execucao.actions
+                             if acao.command == 'create_vm_disk']
+        assert status is True
+        assert acoes_criar_disco
+        assert all(Action.RESOURCE_IDENTIFIER_ID not in acao.args for acao in acoes_criar_disco)
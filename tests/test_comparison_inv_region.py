@@ -35,7 +35,8 @@ class TestComparisonInvRegion(Base):
 
         for vm_obj in inventario.vms.values():
             plano_execucao.actions.append(
-                vm_obj.get_acao_mover_vm_regiao(inventario.get_id_no_regiao(vm_obj.region)))
+                vm_obj.get_acao_mover_vm_regiao(inventario.get_id_no_regiao(vm_obj.region),
+                                                vm_obj.vmm_id))
 
         return plano_execucao
 
@@ -143,7 +143,8 @@ class TestComparisonInvVm(Base):
         for vm_name in inventario_local.vms:
             if inventario_remoto.vms[vm_name].nested_virtualization != novo_valor:
                 plano_execucao.actions.append(
-                    inventario_local.vms[vm_name].get_acao_atualizar_virtualizacao_aninhada())
+                    inventario_local.vms[vm_name].get_acao_atualizar_virtualizacao_aninhada(
+                        inventario_remoto.vms[vm_name].vmm_id))
 
         return plano_execucao
 
@@ -159,7 +160,8 @@ class TestComparisonInvVm(Base):
         for vm_name in inventario_local.vms:
             if inventario_remoto.vms[vm_name].dynamic_memory != novo_valor:
                 plano_execucao.actions.append(
-                    inventario_local.vms[vm_name].get_acao_atualizar_memoria_dinamica())
+                    inventario_local.vms[vm_name].get_acao_atualizar_memoria_dinamica(
+                        inventario_remoto.vms[vm_name].vmm_id))
 
         return plano_execucao
 
@@ -258,3 +260,20 @@ class TestComparisonInvVm(Base):
         assert status is True
         assert plano_execucao == self.get_plano_execucao_alterar_memoria_dinamica(
             inventario_local, inventario_remoto, dynamic_memory)
+
+    def test_vm_recriada_sem_id_remoto(self):
+        inventario_local = Base.get_inventario_completo()
+        inventario_remoto = copy.deepcopy(inventario_local)
+        self.alterar_imagem_vms_inventario(inventario_local)
+        self.alterar_memoria_dinamica_vms_inventario(inventario_local, True)
+        self.alterar_memoria_dinamica_vms_inventario(inventario_remoto, False)
+
+        status, plano_execucao = inventario_local.calcular_plano_execucao(
+            inventario_remoto)
+
+        # A VM recriada recebe um novo ID: as demais ações usam o nome
+        acoes_memoria = [action for action in plano_execucao.actions
+                         if action.command == 'update_dynamic_memory']
+        assert status is True
+        assert len(acoes_memoria) == len(inventario_local.vms)
+        assert all('vm_id' not in action.args for action in acoes_memoria)
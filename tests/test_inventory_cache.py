@@ -0,0 +1,34 @@
+"""
+Testes do InventoryCache
+"""
+from vmm_manager.parser.inventory_cache import InventoryCache
+
+
+class TestInventoryCache:
+    VERSOES = {'id-1': '638000000000000000', 'id-2': '638000000000000001'}
+    REGISTROS = [{'Tipo': 'VM', 'ID': 'id-1', 'Name': 'VM01'},
+                 {'Tipo': 'VM', 'ID': 'id-2', 'Name': 'VM02'}]
+
+    def test_copia_reaproveitada(self, tmp_path):
+        cache = InventoryCache(str(tmp_path))
+        cache.salvar('vmm', 'cloud', 'group', self.VERSOES, True, self.REGISTROS)
+
+        assert cache.carregar('VMM', 'cloud', 'GROUP', True) == (self.VERSOES, self.REGISTROS, True)
+        # Os dados completos também atendem às consultas resumidas
+        assert cache.carregar('vmm', 'cloud', 'group', False) == (self.VERSOES, self.REGISTROS, True)
+
+    def test_copia_incompleta(self, tmp_path):
+        cache = InventoryCache(str(tmp_path))
+        cache.salvar('vmm', 'cloud', 'group', self.VERSOES, False, self.REGISTROS)
+
+        assert cache.carregar('vmm', 'cloud', 'group', True) is None
+        assert cache.carregar('vmm', 'cloud', 'group', False) == (self.VERSOES, self.REGISTROS, False)
+        assert cache.carregar('vmm', 'cloud', 'other', False) is None
+
+    def test_copia_invalida(self, tmp_path):
+        cache = InventoryCache(str(tmp_path))
+        cache.salvar('vmm', 'cloud', 'group', self.VERSOES, False, self.REGISTROS)
+        for arquivo in tmp_path.iterdir():
+            arquivo.write_text('{"id": ')
+
+        assert cache.carregar('vmm', 'cloud', 'group', False) is None
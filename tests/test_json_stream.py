@@ -0,0 +1,98 @@
+"""
+Testes do parser incremental de JSON
+"""
+import base64
+import gzip
+import json
+from random import randint
+
+import pytest
+
+from tests.utils import Utils
+from vmm_manager.util.json_stream import (GzipBase64StreamDecoder,
+                                          JsonArrayStreamParser,
+                                          NdjsonStreamParser)
+
+
+class TestJsonStream:
+
+    @staticmethod
+    def alimentar_em_partes(texto, compactado=False, classe_leitor=JsonArrayStreamParser):
+        elementos = []
+        leitor_json = classe_leitor(elementos.append)
+        leitor = GzipBase64StreamDecoder(leitor_json.alimentar) if compactado else leitor_json
+
+        inicio = 0
+        while inicio < len(texto):
+            fim = inicio + randint(1, 7)
+            leitor.alimentar(texto[inicio:fim])
+            inicio = fim
+        leitor.finalizar()
+        if compactado:
+            leitor_json.finalizar()
+
+        return elementos
+
+    @staticmethod
+    def compactar(texto):
+        return GzipBase64StreamDecoder.PREFIXO + \
+            base64.b64encode(gzip.compress(texto.encode('utf-8'))).decode('ascii') + '\r\n'
+
+    def test_array_em_partes(self):
+        dados_teste = Utils()
+        documento = [{
+            'Name': dados_teste.get_nome_unico(),
+            'Description': 'Descrição com "aspas", [colchetes], {chaves} e barra \\',
+            'Networks': [{'Name': dados_teste.get_random_word(), 'IPS': '10.0.0.1'}],
+            'Discos': [],
+        } for _ in range(randint(1, 20))]
+
+        texto = json.dumps(documento, indent=4)
+
+        assert TestJsonStream.alimentar_em_partes(texto) == documento
+
+    def test_objeto_unico(self):
+        documento = {'Name': 'VM', 'Discos': [{'File': 'disco.vhdx'}]}
+
+        assert TestJsonStream.alimentar_em_partes(json.dumps(documento)) == [documento]
+
+    def test_saida_vazia(self):
+        assert not TestJsonStream.alimentar_em_partes('')
+        assert not TestJsonStream.alimentar_em_partes('[]')
+
+    def test_documento_incompleto(self):
+        leitor_json = JsonArrayStreamParser(lambda _: None)
+        leitor_json.alimentar('[{"Name": "VM"}, {"Name"')
+
+        with pytest.raises(ValueError):
+            leitor_json.finalizar()
+
+    def test_saida_compactada(self):
+        documento = [{'Name': f'VM{num}', 'Description': 'Descrição'} for num in range(50)]
+
+        texto = TestJsonStream.compactar(json.dumps(documento, separators=(',', ':')))
+
+        assert TestJsonStream.alimentar_em_partes(texto, compactado=True) == documento
+
+    def test_saida_nao_compactada(self):
+        with pytest.raises(ValueError):
+            GzipBase64StreamDecoder(lambda _: None).alimentar('[{"Name": "VM"}]')
+
+    def test_ndjson_em_partes(self):
+        documento = [{'Name': f'VM{num}', 'Description': 'Linha com \\n e "aspas"',
+                      'Networks': [{'IPS': '10.0.0.1'}]} for num in range(randint(1, 20))]
+
+        # Saída do PowerShell: uma linha por objeto, terminada em CRLF
+        texto = ''.join(json.dumps(elemento) + '\r\n' for elemento in documento)
+
+        assert TestJsonStream.alimentar_em_partes(
+            texto, classe_leitor=NdjsonStreamParser) == documento
+        assert TestJsonStream.alimentar_em_partes(
+            texto.rstrip(), classe_leitor=NdjsonStreamParser) == documento
+
+    def test_ndjson_incompleto(self):
+        leitor_json = NdjsonStreamParser(lambda _: None)
+        leitor_json.alimentar('{"Name": "VM"}\n{"Name"')
+
+        with pytest.raises(ValueError):
+            leitor_json.finalizar()
@@ -0,0 +1,344 @@
+"""
+Testes do ParserRemote
+"""
+import base64
+import gzip
+import json
+import uuid
+from random import choice, randint, randrange
+
+import pytest
+
+from tests.base import Base
+from tests.utils import Utils
+from vmm_manager.parser.inventory_cache import InventoryCache
+from vmm_manager.parser.parser_remote import ParserRemote
+from vmm_manager.scvmm.enums import SCDiskBusType, SCDiskSizeType
+from vmm_manager.util.config import FIELD_GROUP
+
+
+class TestParserRemote(Base):
+    # Sem compactação, uma linha JSON por registro
+    CONSULTAS_NDJSON = ['get_inventory_snapshot', 'get_inventory_fingerprint']
+
+    @staticmethod
+    def get_vms_remotas(dados_teste):
+        return [{
+            'Tipo': 'VM',
+            'ID': str(uuid.uuid4()),
+            'Name': dados_teste.get_nome_unico(),
+            'Description': list(dados_teste.get_random_word().encode('utf-8')),
+            'Status': 0,
+            'RegionHostname': dados_teste.get_random_word(),
+            'Cpu': randint(Base.CPU_MIN, Base.CPU_MAX),
+            'Ram': randint(Base.RAM_MIN, Base.RAM_MAX),
+            'Networks': [{
+                'Name': dados_teste.get_random_word(),
+                # IPv4Addresses serializado pelo ConvertTo-Json
+                'IPS': ['10.0.0.1', '10.0.0.2'],
+                'Principal': num_iter == 0,
+            } for num_iter in range(randrange(1, Base.REDES_POR_VM_MAX))],
+            'Image': dados_teste.get_random_word(),
+            'Region': Utils.get_random_regiao_vm(Base.REGIOES_QTDE),
+            'NestedVirtualization': False,
+            'DynamicMemory': True,
+        } for _ in range(randrange(1, Base.VMS_POR_TESTE_MAX))]
+
+    @staticmethod
+    def add_discos_remotos(dados_teste, vms_remotas):
+        for vm_remota in vms_remotas:
+            vm_remota['Discos'] = [{
+                'DriveID': str(uuid.uuid4()),
+                'DiskID': str(uuid.uuid4()),
+                'Type': choice(list(SCDiskBusType)).value,
+                'File': dados_teste.get_nome_unico(),
+                'SizeMB': randint(Base.TAMANHO_DISCO_MIN, Base.TAMANHO_DISCO_MAX),
+                'SizeType': choice(list(SCDiskSizeType)).value,
+                'Path': dados_teste.get_random_word(),
+                'Bus': 0,
+                'Lun': num_iter + 1,
+            } for num_iter in range(randrange(0, Base.DISCOS_POR_VM_MAX))]
+
+    @staticmethod
+    def get_versao_remota(vm_remota, status='Running', ips='10.0.0.1'):
+        # Mesmo formato do get_inventory_fingerprint: ModifiedTime|Status|host|IPs|propriedades
+        propriedades = ','.join(['group', vm_remota['Name'], vm_remota['Image'],
+                                 vm_remota['Region'], vm_remota['Networks'][0]['Name']])
+        return f"638000000000000000|{status}|{vm_remota['RegionHostname']}|{ips}|{propriedades}"
+
+    @staticmethod
+    def get_regioes_remotas(dados_teste):
+        return [{
+            'Tipo': 'Region',
+            'HostID': str(uuid.uuid4()),
+            'Hostname': dados_teste.get_nome_unico(),
+            'Group': dados_teste.get_random_word(),
+            'Cluster': dados_teste.get_random_word(),
+        } for _ in range(Base.REGIOES_QTDE)]
+
+    @staticmethod
+    def configurar_servidor(servidor_acesso, respostas, compactar_saida=False):
+        servidor_acesso.compactar_saida = compactar_saida
+
+        def executar_script(name, _conteudo, ao_receber_saida=None, parametros=None):
+            saida = json.dumps(respostas[name], indent=4)
+            if not compactar_saida and name in TestParserRemote.CONSULTAS_NDJSON:
+                saida = ''.join(json.dumps(registro) + '\r\n' for registro in respostas[name])
+            elif compactar_saida:
+                saida = 'gzip:' + base64.b64encode(
+                    gzip.compress(saida.encode('utf-8'))).decode('ascii') + '\r\n'
+
+            # saída entregue em partes, como no canal SSH
+            for inicio in range(0, len(saida), 16):
+                ao_receber_saida(saida[inicio:inicio + 16])
+            return True, ''
+
+        servidor_acesso.executar_script.side_effect = executar_script
+
+    @pytest.mark.parametrize('compactar_saida', [False, True])
+    def test_inventario_remoto(self, servidor_acesso, compactar_saida):
+        dados_teste = Utils()
+        vms_remotas = TestParserRemote.get_vms_remotas(dados_teste)
+        TestParserRemote.add_discos_remotos(dados_teste, vms_remotas)
+        TestParserRemote.configurar_servidor(servidor_acesso, {
+            'get_inventory_snapshot': vms_remotas,
+            'get_available_regions': TestParserRemote.get_regioes_remotas(dados_teste),
+        }, compactar_saida)
+
+        status, inventario = ParserRemote('group', 'cloud').get_inventario(servidor_acesso)
+
+        assert status is True
+        assert sorted(inventario.vms) == sorted(vm_remota['Name'] for vm_remota in vms_remotas)
+        for vm_remota in vms_remotas:
+            vm_obj = inventario.vms[vm_remota['Name']]
+            assert vm_obj.vmm_id == vm_remota['ID']
+            assert vm_obj.cpu == vm_remota['Cpu']
+            assert vm_obj.networks[0].ips == ['10.0.0.1', '10.0.0.2']
+            assert sorted(vm_obj.additional_disks) == sorted(
+                disco['File'] for disco in vm_remota['Discos'])
+        # VMs e discos obtidos em uma única ida ao servidor
+        assert servidor_acesso.executar_script.call_count == 1
+        # Sem compactação, cada VM é escrita numa linha assim que processada
+        conteudo = servidor_acesso.executar_script.call_args.args[1]
+        assert ('ConvertTo-Json -Depth 3 -Compress $registro_vm' in conteudo) is not compactar_saida
+        assert len(inventario.get_mapeamento_regioes_to_test()) == Base.REGIOES_QTDE
+
+    @pytest.mark.parametrize('ips', [['10.0.0.1', '10.0.0.2'], '10.0.0.1 10.0.0.2'])
+    def test_inventario_remoto_ips_ndjson(self, servidor_acesso, ips):
+        dados_teste = Utils()
+        vms_remotas = TestParserRemote.get_vms_remotas(dados_teste)
+        for vm_remota in vms_remotas:
+            for network in vm_remota['Networks']:
+                network['IPS'] = ips
+        TestParserRemote.configurar_servidor(servidor_acesso, {
+            'get_inventory_snapshot': vms_remotas,
+        })
+
+        status, inventario = ParserRemote('group', 'cloud').get_inventario(servidor_acesso)
+
+        assert status is True
+        for vm_remota in vms_remotas:
+            assert all(network.ips == ['10.0.0.1', '10.0.0.2']
+                       for network in inventario.vms[vm_remota['Name']].networks)
+        # Cada registro é serializado a partir do nível 0: os IPs são enviados como texto
+        conteudo = servidor_acesso.executar_script.call_args.args[1]
+        assert "IPS = $interface.IPv4Addresses -join ' '" in conteudo
+
+    def test_inventario_remoto_com_campos(self, servidor_acesso):
+        dados_teste = Utils()
+        vms_remotas = [{campo: vm_remota[campo] for campo in ['Tipo', 'ID', 'Name', 'Status']}
+                       for vm_remota in TestParserRemote.get_vms_remotas(dados_teste)]
+        TestParserRemote.configurar_servidor(servidor_acesso, {
+            'get_inventory_snapshot': vms_remotas,
+        })
+
+        status, inventario = ParserRemote('group', 'cloud').get_inventario(
+            servidor_acesso, filtro_dados_completos=True, campos=['status'])
+
+        assert status is True
+        for vm_remota in vms_remotas:
+            vm_obj = inventario.vms[vm_remota['Name']]
+            vm_obj.to_json_campos = ['status']
+            assert vm_obj.to_dict() == {'name': vm_remota['Name'], 'status': 0}
+        # Somente as propriedades pedidas são calculadas no servidor
+        conteudo = servidor_acesso.executar_script.call_args.args[1]
+        assert 'Status =' in conteudo
+        assert 'VirtualNetworkAdapters' not in conteudo
+        assert 'VirtualDiskDrives' not in conteudo
+        assert 'Description =' not in conteudo
+        # Regiões são consultadas somente no primeiro uso
+        assert servidor_acesso.executar_script.call_count == 1
+
+    def test_regioes_consultadas_no_primeiro_uso(self, servidor_acesso):
+        dados_teste = Utils()
+        regioes_remotas = TestParserRemote.get_regioes_remotas(dados_teste)
+        TestParserRemote.configurar_servidor(servidor_acesso, {
+            'get_inventory_snapshot': TestParserRemote.get_vms_remotas(dados_teste),
+            'get_available_regions': regioes_remotas,
+        })
+
+        status, inventario = ParserRemote('group', 'cloud').get_inventario(servidor_acesso)
+
+        assert status is True
+        assert servidor_acesso.executar_script.call_count == 1
+
+        ids_hosts = [regiao['HostID'] for regiao in regioes_remotas]
+        assert inventario.get_id_no_regiao('A') in ids_hosts
+        assert inventario.get_nome_no_regiao('B') in [regiao['Hostname'] for regiao in regioes_remotas]
+        assert inventario.get_id_no_regiao('A') in ids_hosts
+        assert [chamada.args[0] for chamada in servidor_acesso.executar_script.call_args_list] \
+            == ['get_inventory_snapshot', 'get_available_regions']
+
+    def test_regioes_com_erro(self, servidor_acesso):
+        dados_teste = Utils()
+        TestParserRemote.configurar_servidor(servidor_acesso, {
+            'get_inventory_snapshot': TestParserRemote.get_vms_remotas(dados_teste),
+        })
+        status, inventario = ParserRemote('group', 'cloud').get_inventario(servidor_acesso)
+        assert status is True
+
+        servidor_acesso.executar_script.side_effect = None
+        servidor_acesso.executar_script.return_value = False, 'Erro no VMM'
+        with pytest.raises(ValueError, match='Erro no VMM'):
+            inventario.get_id_no_regiao('A')
+
+    def test_propriedades_customizadas_lidas_em_lote(self, servidor_acesso, tmp_path):
+        dados_teste = Utils()
+        vms_remotas = TestParserRemote.get_vms_remotas(dados_teste)
+        TestParserRemote.add_discos_remotos(dados_teste, vms_remotas)
+        TestParserRemote.configurar_servidor(servidor_acesso, {
+            'get_inventory_fingerprint': [{'Tipo': 'Version', 'ID': vm_remota['ID'],
+                                           'Version': TestParserRemote.get_versao_remota(vm_remota)}
+                                          for vm_remota in vms_remotas],
+            'get_inventory_snapshot': vms_remotas,
+        })
+        servidor_acesso.vmm_server = 'vmm'
+
+        status, _ = ParserRemote('group', 'cloud', InventoryCache(str(tmp_path))).get_inventario(
+            servidor_acesso)
+
+        assert status is True
+        consultas = {chamada.args[0]: chamada.args[1]
+                     for chamada in servidor_acesso.executar_script.call_args_list}
+        assert sorted(consultas) == sorted(TestParserRemote.CONSULTAS_NDJSON)
+        for conteudo in consultas.values():
+            # Nenhuma chamada ao VMM por VM: os campos vêm do objeto da VM
+            assert 'Get-SCCustomPropertyValue' not in conteudo
+            # Filtro do grupo aplicado na própria varredura da nuvem, antes do laço por VM
+            filtro_grupo = f'$_.CustomProperty["{FIELD_GROUP[0]}"] -eq "group"'
+            assert conteudo.count('Get-SCVirtualMachine -VMMServer') == 1
+            assert conteudo.index(filtro_grupo) < conteudo.index('foreach($vm in $vms_grupo)')
+            corpo_laco = conteudo[conteudo.index('foreach($vm in $vms_grupo)'):]
+            assert corpo_laco.count('$vm.CustomProperty') == 1
+
+    def test_inventario_remoto_em_cache(self, servidor_acesso, tmp_path):
+        dados_teste = Utils()
+        # Ao menos duas VMs: uma alterada e outra reaproveitada da cópia local
+        vms_remotas = TestParserRemote.get_vms_remotas(dados_teste) \
+            + TestParserRemote.get_vms_remotas(dados_teste)
+        TestParserRemote.add_discos_remotos(dados_teste, vms_remotas)
+        versoes = [{'Tipo': 'Version', 'ID': vm_remota['ID'],
+                    'Version': TestParserRemote.get_versao_remota(vm_remota)}
+                   for vm_remota in vms_remotas]
+        respostas = {
+            'get_inventory_fingerprint': list(versoes),
+            'get_inventory_snapshot': vms_remotas,
+        }
+        TestParserRemote.configurar_servidor(servidor_acesso, respostas)
+        servidor_acesso.vmm_server = 'vmm'
+        cache = InventoryCache(str(tmp_path))
+
+        def get_scripts_executados():
+            scripts = [chamada.args[0]
+                       for chamada in servidor_acesso.executar_script.call_args_list]
+            servidor_acesso.executar_script.reset_mock()
+            return scripts
+
+        for scripts_esperados in [['get_inventory_fingerprint', 'get_inventory_snapshot'],
+                                  ['get_inventory_fingerprint']]:
+            status, inventario = ParserRemote('group', 'cloud', cache).get_inventario(
+                servidor_acesso)
+
+            assert status is True
+            # Sem cópia local, nenhuma VM é filtrada pelo ID
+            assert '$ids_consultados' not in servidor_acesso.executar_script.call_args.args[1]
+            assert get_scripts_executados() == scripts_esperados
+            assert sorted(inventario.vms) == sorted(vm_remota['Name'] for vm_remota in vms_remotas)
+
+        # Filtro por nome aplicado sobre a cópia local
+        status, inventario = ParserRemote('group', 'cloud', cache).get_inventario(
+            servidor_acesso, vms_remotas[0]['Name'], False)
+        assert list(inventario.vms) == [vms_remotas[0]['Name']]
+        assert get_scripts_executados() == ['get_inventory_fingerprint']
+
+        # VM alterada no VMM: somente ela é consultada
+        versoes[0]['Version'] = TestParserRemote.get_versao_remota(vms_remotas[0], ips='10.0.0.2')
+        respostas['get_inventory_snapshot'] = [{**vms_remotas[0], 'Cpu': Base.CPU_MAX + 1}]
+        status, inventario = ParserRemote('group', 'cloud', cache).get_inventario(servidor_acesso)
+        assert sorted(inventario.vms) == sorted(vm_remota['Name'] for vm_remota in vms_remotas)
+        assert inventario.vms[vms_remotas[0]['Name']].cpu == Base.CPU_MAX + 1
+        consulta_vms = servidor_acesso.executar_script.call_args_list[-1].args[1]
+        assert f'"{vms_remotas[0]["ID"]}"' in consulta_vms
+        assert all(vm_remota['ID'] not in consulta_vms for vm_remota in vms_remotas[1:])
+        get_scripts_executados()
+
+        # Alteração vista numa consulta resumida: a cópia continua com os dados completos
+        versoes[1]['Version'] = TestParserRemote.get_versao_remota(vms_remotas[1], 'PowerOff')
+        respostas['get_inventory_snapshot'] = [vms_remotas[1]]
+        ParserRemote('group', 'cloud', cache).get_inventario(servidor_acesso, None, False)
+        assert '$drive.VirtualHardDisk' in servidor_acesso.executar_script.call_args_list[-1].args[1]
+        get_scripts_executados()
+        status, inventario = ParserRemote('group', 'cloud', cache).get_inventario(servidor_acesso)
+        assert sorted(inventario.vms[vms_remotas[1]['Name']].additional_disks) == sorted(
+            disco['File'] for disco in vms_remotas[1]['Discos'])
+        assert get_scripts_executados() == ['get_inventory_fingerprint']
+
+        # Somente uma propriedade customizada alterada (ex.: região), sem mudar o
+        # ModifiedTime: a VM é consultada de novo
+        vms_remotas[1]['Region'] = 'Z'
+        versoes[1]['Version'] = TestParserRemote.get_versao_remota(vms_remotas[1], 'PowerOff')
+        respostas['get_inventory_snapshot'] = [vms_remotas[1]]
+        status, inventario = ParserRemote('group', 'cloud', cache).get_inventario(servidor_acesso)
+        assert inventario.vms[vms_remotas[1]['Name']].region == 'Z'
+        assert get_scripts_executados() == ['get_inventory_fingerprint', 'get_inventory_snapshot']
+
+        # VM removida no VMM: descartada sem nova consulta das VMs
+        respostas['get_inventory_fingerprint'].remove(versoes[0])
+        status, inventario = ParserRemote('group', 'cloud', cache).get_inventario(servidor_acesso)
+        assert sorted(inventario.vms) == sorted(vm_remota['Name'] for vm_remota in vms_remotas[1:])
+        assert get_scripts_executados() == ['get_inventory_fingerprint']
+
+    def test_inventarios_grupos_nuvem(self, servidor_acesso):
+        dados_teste = Utils()
+        groups = ['group_a', 'group_b', 'group_c']
+        vms_remotas = TestParserRemote.get_vms_remotas(dados_teste)
+        for num_vm, vm_remota in enumerate(vms_remotas):
+            vm_remota['Group'] = groups[num_vm % 2].upper()
+        TestParserRemote.configurar_servidor(servidor_acesso, {
+            'get_inventory_snapshot': vms_remotas,
+            'get_available_regions': TestParserRemote.get_regioes_remotas(dados_teste),
+        })
+
+        status, inventarios = ParserRemote.get_inventarios_nuvem(servidor_acesso, 'cloud', groups)
+
+        assert status is True
+        # Uma única varredura da nuvem para todos os grupos
+        assert servidor_acesso.executar_script.call_count == 1
+        assert '"group_a","group_b","group_c"' in servidor_acesso.executar_script.call_args.args[1]
+        for num_group, group in enumerate(groups):
+            assert inventarios[group].group == group
+            assert sorted(inventarios[group].vms) == sorted(
+                vm_remota['Name'] for num_vm, vm_remota in enumerate(vms_remotas)
+                if num_vm % 2 == num_group)
+            assert len(inventarios[group].get_mapeamento_regioes_to_test()) == Base.REGIOES_QTDE
+        # Hosts consultados uma única vez para todos os grupos
+        assert servidor_acesso.executar_script.call_count == 2
+
+    def test_inventario_remoto_com_erro(self, servidor_acesso):
+        servidor_acesso.compactar_saida = False
+        servidor_acesso.executar_script.return_value = False, 'Erro no VMM'
+
+        status, msg = ParserRemote('group', 'cloud').get_inventario(servidor_acesso)
+
+        assert status is False
+        assert 'Erro no VMM' in msg
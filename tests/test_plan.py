@@ -0,0 +1,60 @@
+"""
+Testes da execução do Plan
+"""
+import json
+
+from vmm_manager.entity.action import Action
+from vmm_manager.entity.plan import Plan
+
+
+class TestPlan:
+
+    @staticmethod
+    def configurar_servidor(servidor_acesso):
+        servidor_acesso.vmm_server = 'vmm'
+        servidor_acesso.max_canais = 1
+
+        def executar_script(name, conteudo, ao_receber_saida=None, parametros=None):
+            resultado = json.dumps({'Status': 'OK'})
+            if name == 'command_batch':
+                return True, json.dumps(
+                    [{'Stdout': resultado, 'Stderr': ''}] * conteudo.count('$resultados_lote.Add('))
+            return True, resultado
+
+        servidor_acesso.executar_script.side_effect = executar_script
+
+    @staticmethod
+    def get_plano():
+        plano = Plan('group', 'cloud')
+        plano.actions = [Action(Action.ACTION_CREATE_VM, vm_name=f'VM0{num}') for num in range(3)] \
+            + [Action(Action.ACTION_DELETE_VM, vm_id=f'id-{num}', vm_name=f'VM1{num}')
+               for num in range(2)] \
+            + [Action('update_dynamic_memory', vm_name=f'VM2{num}', dynamic_memory=True)
+               for num in range(4)]
+        return plano
+
+    def test_acoes_bloqueantes_uma_por_script(self, servidor_acesso, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        TestPlan.configurar_servidor(servidor_acesso)
+        plano = TestPlan.get_plano()
+
+        plano.executar(servidor_acesso, True)
+
+        scripts = [chamada.args[0] for chamada in servidor_acesso.executar_script.call_args_list]
+        # Criações e exclusões em scripts próprios; as demais ações e as
+        # finalizações das criações em lote
+        assert scripts == ['create_vm'] * 3 + ['delete_vm'] * 2 + ['command_batch'] * 2 \
+            + ['clean_objects_after_vm_creation']
+        assert not plano.has_erro_execucao()
+
+    def test_intervalo_entre_recursos_sem_lote(self, servidor_acesso, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr('vmm_manager.entity.plan.time.sleep', lambda _segundos: None)
+        TestPlan.configurar_servidor(servidor_acesso)
+
+        TestPlan.get_plano().executar(servidor_acesso, True, interval_between_resources=1)
+
+        scripts = [chamada.args[0] for chamada in servidor_acesso.executar_script.call_args_list]
+        # Com intervalo, as ações não bloqueantes também são executadas uma a uma
+        assert scripts == ['create_vm'] * 3 + ['delete_vm'] * 2 + ['command_batch'] \
+            + ['update_dynamic_memory'] * 4 + ['clean_objects_after_vm_creation']
@@ -0,0 +1,45 @@
+"""
+Testes da medição de tempos
+"""
+import pytest
+
+from vmm_manager.util.timing import (ETAPA_DECODIFICACAO, ETAPA_EXECUCAO,
+                                     ETAPA_SERVIDOR, ServerTimingFilter,
+                                     TimingReport)
+
+
+class TestTiming:
+
+    @pytest.mark.parametrize('tamanho_bloco', [1, 5, 1000])
+    def test_marcador_removido_da_saida(self, tamanho_bloco):
+        saida = '[{"Name": "vm"}]\r\n'
+        texto = saida + f'\n{ServerTimingFilter.MARCADOR}1234\r\n'
+        partes = []
+        filtro = ServerTimingFilter(partes.append)
+
+        for inicio in range(0, len(texto), tamanho_bloco):
+            filtro.alimentar(texto[inicio:inicio + tamanho_bloco])
+
+        assert filtro.finalizar() == 1.234
+        assert ''.join(partes).strip() == saida.strip()
+
+    def test_saida_sem_marcador(self):
+        partes = []
+        filtro = ServerTimingFilter(partes.append)
+
+        filtro.alimentar('#vmm')
+        assert filtro.finalizar() is None
+        assert ''.join(partes) == '#vmm'
+
+    def test_etapas_aninhadas_nao_duplicadas(self):
+        relatorio = TimingReport()
+
+        with relatorio.medir_comando('cmd') as medicao:
+            with relatorio.medir(ETAPA_EXECUCAO):
+                with relatorio.medir(ETAPA_DECODIFICACAO):
+                    pass
+            relatorio.registrar(ETAPA_SERVIDOR, 0.5)
+
+        assert medicao.get_tempo_etapas_locais() <= medicao.total
+        assert relatorio.get_dados()[0]['server'] == 500.0
+        assert 'cmd' in relatorio.formatar()
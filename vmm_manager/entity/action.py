@@ -19,6 +19,14 @@ class Action(YamlAble):
     RESOURCE_IDENTIFIER_NAME = 'vm_name'
     RESOURCE_IDENTIFIER_ID = 'vm_id'
 
+    @staticmethod
+    def get_identificadores_recurso(vm_name, vm_id=None):
+        # O ID só é incluído quando conhecido no planejamento (VM já existente)
+        if vm_id:
+            return {Action.RESOURCE_IDENTIFIER_ID: vm_id,
+                    Action.RESOURCE_IDENTIFIER_NAME: vm_name}
+        return {Action.RESOURCE_IDENTIFIER_NAME: vm_name}
+
     def __init__(self, command, **kwargs):
         # Validate if the args contain the resource identifier
         if (
@@ -38,8 +46,9 @@ class Action(YamlAble):
         self.__retorno_execucao = None
         self.__status_execucao_job = None
 
-    def executar(self, group, cloud, servidor_acesso, guid):
+    def get_cmd(self, group, cloud, servidor_acesso, guid):
         cmd = Command(self.command,
+                      description=self.get_str_impressao_inline(),
                       group=group,
                       field_group=FIELD_GROUP[0],
                       field_id=FIELD_ID[0],
@@ -52,14 +61,19 @@ class Action(YamlAble):
         # Add the specific args for the command
         cmd.args.update(self.args)
 
-        status, retorno = cmd.executar(servidor_acesso)
+        return cmd
 
+    def registrar_resultado_execucao(self, status, retorno):
         self.__status_execucao = status
         self.__retorno_execucao = json.loads(
             retorno) if self.__status_execucao else retorno
 
         return self.__status_execucao, self.__retorno_execucao
 
+    def executar(self, group, cloud, servidor_acesso, guid):
+        cmd = self.get_cmd(group, cloud, servidor_acesso, guid)
+        return self.registrar_resultado_execucao(*cmd.executar(servidor_acesso))
+
     def informar_status_execucao_job(self, status):
         self.__status_execucao_job = status
 
@@ -19,7 +19,7 @@ def json_handle_inventory(obj):
 class Inventory:
 
     @staticmethod
-    def get_json(inventario_local, inventario_remoto, all_data=True):
+    def get_json(inventario_local, inventario_remoto, all_data=True, campos=None):
         for vm_name in inventario_remoto.vms:
             if vm_name not in inventario_local.vms:
                 # máquina órfã: não exibir
@@ -29,7 +29,9 @@ class Inventory:
                 inventario_local.vms[vm_name].dados_ansible
 
             # definindo tipo de impressão
-            inventario_remoto.vms[vm_name].to_json_dados_completos = all_data
+            inventario_remoto.vms[vm_name].to_json_dados_completos = \
+                all_data or 'additional_disks' in (campos or [])
+            inventario_remoto.vms[vm_name].to_json_campos = campos
 
         return True, json.dumps(inventario_remoto,
                                 default=json_handle_inventory,
@@ -43,6 +45,7 @@ class Inventory:
 
         self.__regioes_por_letra_id = None
         self.__regioes_disponiveis = None
+        self.__provedor_regioes = None
 
     def get_nome_no_regiao(self, region):
         self.__retirar_regiao_pool(region)
@@ -61,6 +64,8 @@ class Inventory:
         raise ValueError(f"Region '{region}' does not have a host defined.")
 
     def get_mapeamento_regioes_to_test(self):
+        self.__carregar_regioes()
+
         # flush regions
         it_regioes = 0
         while self.__regioes_disponiveis:
@@ -76,7 +81,28 @@ class Inventory:
         self.__regioes_por_letra_id = {}
         self.__regioes_disponiveis = regioes_disponiveis
 
+    def set_provedor_regioes(self, provedor_regioes):
+        # Função que retorna (status, regiões): chamada somente no primeiro uso de uma região
+        self.__regioes_por_letra_id = None
+        self.__regioes_disponiveis = None
+        self.__provedor_regioes = provedor_regioes
+
+    def __carregar_regioes(self):
+        if self.__regioes_por_letra_id is not None or not self.__provedor_regioes:
+            return
+
+        status, regioes_disponiveis = self.__provedor_regioes()
+        if not status:
+            raise ValueError(regioes_disponiveis)
+
+        # Cópia: as regiões são retiradas da lista à medida que são usadas
+        self.set_regioes_disponiveis(list(regioes_disponiveis))
+
     def __retirar_regiao_pool(self, region):
+        self.__carregar_regioes()
+        if self.__regioes_por_letra_id is None:
+            raise ValueError('Regions map not set.')
+
         if region in self.__regioes_por_letra_id:
             return
 
@@ -103,8 +129,12 @@ class Inventory:
             inventario_remoto, plano_execucao)
         self.__add_acoes_diferenca_discos_adicionais(
             inventario_remoto, plano_execucao)
-        self.__add_acoes_diferenca_regiao(
-            inventario_remoto, plano_execucao)
+        try:
+            # As regiões remotas são consultadas aqui, no primeiro uso
+            self.__add_acoes_diferenca_regiao(
+                inventario_remoto, plano_execucao)
+        except ValueError as ex:
+            return False, str(ex)
         self.__add_acoes_virtualizacao_aninhada(
             inventario_remoto, plano_execucao)
         self.__add_acoes_memoria_dinamica(
@@ -180,10 +210,6 @@ class Inventory:
         if msg:
             raise ValueError(msg)
 
-    def set_discos_vms(self, additional_disks):
-        for vm_name in additional_disks:
-            self.vms[vm_name].add_discos_adicionais(additional_disks[vm_name])
-
     def __add_acoes_criar_vms(self, inventario_remoto, plano_execucao):
         vms_inserir = [
             nome_vm_local for nome_vm_local in self.vms
@@ -10,7 +10,7 @@ import yaml
 from yamlable import YamlAble, yaml_info
 
 from vmm_manager.entity.action import Action
-from vmm_manager.infra.command import Command
+from vmm_manager.infra.command import Command, CommandBatch
 from vmm_manager.scvmm.scjob import SCJob
 from vmm_manager.util.msgs import (formatar_msg_erro, imprimir_acao_corrente,
                                    imprimir_erro, imprimir_ok)
@@ -31,9 +31,13 @@ class Plan(YamlAble):
             return False, f"Error loading the plan '{execution_plan_file}'.\n{erro}"
 
     @staticmethod
-    def excluir_arquivo():
-        if os.path.exists(Plan.ARQUIVO_PLANO_EXECUCAO):
-            os.remove(Plan.ARQUIVO_PLANO_EXECUCAO)
+    def get_arquivo_plano_grupo(group):
+        return f'plan-{group}.yaml'
+
+    @staticmethod
+    def excluir_arquivo(arquivo=ARQUIVO_PLANO_EXECUCAO):
+        if os.path.exists(arquivo):
+            os.remove(arquivo)
 
     @staticmethod
     def __excluir_arquivo_log_erros():
@@ -53,23 +57,41 @@ class Plan(YamlAble):
     def is_vazio(self):
         return not self.actions
 
-    def gerar_arquivo(self):
+    def gerar_arquivo(self, arquivo=ARQUIVO_PLANO_EXECUCAO):
         try:
             conteudo = yaml.safe_dump(self, default_flow_style=False)
-            with open(Plan.ARQUIVO_PLANO_EXECUCAO, 'w', encoding='utf8') as arquivo_yaml:
+            with open(arquivo, 'w', encoding='utf8') as arquivo_yaml:
                 arquivo_yaml.write(conteudo)
         except IOError as erro:
-            return False, f'Error generating file {Plan.ARQUIVO_PLANO_EXECUCAO}.\n{erro}'
+            return False, f'Error generating file {arquivo}.\n{erro}'
 
         return True, conteudo
 
-    def __executar_acoes(self, actions, servidor_acesso, ocultar_progresso):
-        if not actions:
-            return  # return early if there are no actions to execute
-
-        # zerando jobs em execução
-        self.__jobs_em_execucao = {}
+    def __get_guid_acao(self, acao):
+        # Caso específico de criação de vms
+        guid = uuid.uuid4()
+        if acao.is_criacao_vm():
+            self.__guids_a_limpar.append(guid)
+
+        return guid
+
+    def __processar_resultado_acao(self, acao, ocultar_progresso):
+        if acao.was_executada_com_sucesso():
+            guid = acao.get_resultado_execucao().get('Guid')
+            if guid:
+                # Job em execução
+                self.__jobs_em_execucao[guid] = SCJob(
+                    guid, acao)
+                print(f'[Started {guid}]')
+            else:
+                # Comando já finalizado
+                imprimir_ok(ocultar_progresso)
+        else:
+            imprimir_erro(ocultar_progresso)
+            self.__logar_erros_acao(
+                acao, acao.get_resultado_execucao().get('Msgs'))
 
+    def __executar_acoes_sequencial(self, actions, servidor_acesso, ocultar_progresso):
         total_acoes = len(actions)
         for i in range(total_acoes):
             acao = actions[i]
@@ -77,29 +99,9 @@ class Plan(YamlAble):
             print(f'{textwrap.shorten(acao.get_str_impressao_inline(), 100)} => ',
                   end='', flush=True)
 
-            # Caso específico de criação de vms
-            guid = uuid.uuid4()
-            if acao.is_criacao_vm():
-                self.__guids_a_limpar.append(guid)
-
             acao.executar(self.group, self.cloud,
-                          servidor_acesso, guid)
-
-            # Tratando resultado
-            if acao.was_executada_com_sucesso():
-                guid = acao.get_resultado_execucao().get('Guid')
-                if guid:
-                    # Job em execução
-                    self.__jobs_em_execucao[guid] = SCJob(
-                        guid, acao)
-                    print(f'[Started {guid}]')
-                else:
-                    # Comando já finalizado
-                    imprimir_ok(ocultar_progresso)
-            else:
-                imprimir_erro(ocultar_progresso)
-                self.__logar_erros_acao(
-                    acao, acao.get_resultado_execucao().get('Msgs'))
+                          servidor_acesso, self.__get_guid_acao(acao))
+            self.__processar_resultado_acao(acao, ocultar_progresso)
 
             # If the action is not the last, check if we need to wait
             if i < total_acoes - 1:
@@ -114,6 +116,37 @@ class Plan(YamlAble):
                     time.sleep(self.interval_between_resources)
                     imprimir_ok(ocultar_progresso)
 
+    def __executar_acoes_em_lote(self, actions, servidor_acesso, ocultar_progresso):
+        # Os comandos de cada lote são executados em sequência, em um único script remoto
+        for inicio in range(0, len(actions), CommandBatch.TAMANHO_LOTE):
+            acoes_lote = actions[inicio:inicio + CommandBatch.TAMANHO_LOTE]
+            lote = CommandBatch([
+                acao.get_cmd(self.group, self.cloud,
+                             servidor_acesso, self.__get_guid_acao(acao))
+                for acao in acoes_lote])
+
+            for acao, resultado in zip(acoes_lote, lote.executar(servidor_acesso), strict=True):
+                print(f'{textwrap.shorten(acao.get_str_impressao_inline(), 100)} => ',
+                      end='', flush=True)
+
+                acao.registrar_resultado_execucao(*resultado)
+                self.__processar_resultado_acao(acao, ocultar_progresso)
+
+    def __executar_acoes(self, actions, servidor_acesso, ocultar_progresso, em_lote=False):
+        if not actions:
+            return  # return early if there are no actions to execute
+
+        # zerando jobs em execução
+        self.__jobs_em_execucao = {}
+
+        # O intervalo entre recursos exige a execução de uma ação por vez
+        if em_lote and self.interval_between_resources <= 0:
+            self.__executar_acoes_em_lote(
+                actions, servidor_acesso, ocultar_progresso)
+        else:
+            self.__executar_acoes_sequencial(
+                actions, servidor_acesso, ocultar_progresso)
+
         # Monitorando jobs
         SCJob.monitore_jobs(self.__jobs_em_execucao, servidor_acesso)
         self.__coletar_resultado_jobs()
@@ -133,7 +166,8 @@ class Plan(YamlAble):
 
         print('\nApplied operations:')
 
-        # actions bloqueantes primeiro
+        # actions bloqueantes primeiro, uma por script: são pesadas (ex.: criação
+        # de VMs) e o progresso de cada uma é exibido assim que termina
         acoes_bloqueantes = [
             acao for acao in self.actions if acao.is_bloqueante()]
         self.__executar_acoes(
@@ -144,7 +178,7 @@ class Plan(YamlAble):
             acoes_nao_bloqueantes = [acao
                                      for acao in self.actions if not acao.is_bloqueante()]
             self.__executar_acoes(
-                acoes_nao_bloqueantes, servidor_acesso, ocultar_progresso)
+                acoes_nao_bloqueantes, servidor_acesso, ocultar_progresso, em_lote=True)
 
         # Ações de finalização
         self.__limpar_guids(servidor_acesso, ocultar_progresso)
@@ -152,20 +186,25 @@ class Plan(YamlAble):
         Plan.excluir_arquivo()
 
     def __executar_cmds_finalizacao(self, actions, servidor_acesso, ocultar_progresso):
-        for acao in actions:
-            if acao.was_executada_com_sucesso() and acao.has_cmd_pos_execucao():
-                cmd = acao.get_cmd_pos_execucao(
-                    self.group, servidor_acesso)
+        cmds = [acao.get_cmd_pos_execucao(self.group, servidor_acesso)
+                for acao in actions
+                if acao.was_executada_com_sucesso() and acao.has_cmd_pos_execucao()]
 
-                imprimir_acao_corrente(cmd.description, ocultar_progresso)
+        # Os comandos de finalização são independentes entre si:
+        # lotes executados em paralelo
+        resultados_lotes = Command.executar_concorrente(
+            CommandBatch.dividir_em_lotes(cmds), servidor_acesso)
+        resultados = [resultado for resultados_lote in resultados_lotes
+                      for resultado in resultados_lote]
 
-                status, resultado = cmd.executar(servidor_acesso)
+        for cmd, (status, resultado) in zip(cmds, resultados, strict=True):
+            imprimir_acao_corrente(cmd.description, ocultar_progresso)
 
-                if status:
-                    imprimir_ok(ocultar_progresso)
-                else:
-                    imprimir_erro(ocultar_progresso)
-                    self.__logar_erros_comando(cmd.description, resultado)
+            if status:
+                imprimir_ok(ocultar_progresso)
+            else:
+                imprimir_erro(ocultar_progresso)
+                self.__logar_erros_comando(cmd.description, resultado)
 
     def __limpar_guids(self, servidor_acesso, ocultar_progresso):
         if self.__guids_a_limpar:
@@ -10,6 +10,10 @@ from vmm_manager.scvmm.scregion import SCRegion
 
 
 class VM:
+    # Campos do JSON (show), na ordem de to_dict
+    CAMPOS_JSON = ['name', 'description', 'image', 'region', 'cpu', 'memory', 'networks',
+                   'vmm_id', 'status', 'region_host', 'ansible', 'additional_disks']
+
     def __init__(
         self,
         name,
@@ -41,6 +45,7 @@ class VM:
         self.dados_ansible = {}
         self.additional_disks = {}
         self.to_json_dados_completos = True
+        self.to_json_campos = None
 
     def extrair_dados_ansible_dict(self, dict_ansible):
         for item in dict_ansible or {}:
@@ -61,6 +66,18 @@ class VM:
         for additional_disk in additional_disks:
             self.additional_disks[additional_disk.file] = additional_disk
 
+    def is_recriacao_necessaria(self, vm_remota: Self):
+        # alteração da image é irreversível
+        # Alteração de network é possível recuperar TODO #18
+        return self.image != vm_remota.image or self.networks != vm_remota.networks
+
+    def get_id_vm_remota(self, vm_remota: Self):
+        # O ID só é conhecido para VMs existentes e que não serão recriadas no plano;
+        # nos demais casos, a VM é localizada pelo nome
+        if vm_remota and not self.is_recriacao_necessaria(vm_remota):
+            return vm_remota.vmm_id
+        return None
+
     def add_acoes_diferenca_discos_adicionais(self, vm_remota: Self, plano_execucao):
         # discos a excluir
         if vm_remota:
@@ -82,12 +99,14 @@ class VM:
             # discos a criar
             if not vm_remota or nome_disco not in vm_remota.additional_disks:
                 plano_execucao.actions.append(
-                    data_disco.get_acao_criar_disco(self.name))
+                    data_disco.get_acao_criar_disco(
+                        self.name, self.get_id_vm_remota(vm_remota)))
             else:
                 # discos a alterar
                 plano_execucao.actions.extend(
                     data_disco.get_acoes_diferenca_disco(
-                        vm_remota.additional_disks[nome_disco], vm_remota.vmm_id, self.name))
+                        vm_remota.additional_disks[nome_disco], vm_remota.vmm_id, self.name,
+                        self.get_id_vm_remota(vm_remota)))
 
     def add_acoes_diferenca_regiao(
         self,
@@ -102,30 +121,26 @@ class VM:
             or (self.region != vm_remota.region or
                 inv_remoto.get_nome_no_regiao(self.region) != vm_remota.region_host)):
             plano_execucao.actions.append(self.get_acao_mover_vm_regiao(
-                inv_remoto.get_id_no_regiao(self.region)))
+                inv_remoto.get_id_no_regiao(self.region),
+                self.get_id_vm_remota(vm_remota)))
 
     def add_acoes_virtualizacao_aninhada(self, vm_remota,
                                          plano_execucao):
         if ((not vm_remota and self.nested_virtualization)
                 or (vm_remota and vm_remota.nested_virtualization != self.nested_virtualization)):
             plano_execucao.actions.append(
-                self.get_acao_atualizar_virtualizacao_aninhada())
+                self.get_acao_atualizar_virtualizacao_aninhada(
+                    self.get_id_vm_remota(vm_remota)))
 
     def add_acoes_memoria_dinamica(self, vm_remota,
                                    plano_execucao):
         if (vm_remota and vm_remota.dynamic_memory != self.dynamic_memory):
             plano_execucao.actions.append(
-                self.get_acao_atualizar_memoria_dinamica())
+                self.get_acao_atualizar_memoria_dinamica(
+                    self.get_id_vm_remota(vm_remota)))
 
     def add_acoes_diferenca_vm(self, vm_remota: Self, plano_execucao):
-        # alteração da image é irreversível
-        if self.image != vm_remota.image:
-            plano_execucao.actions.append(vm_remota.get_acao_excluir_vm())
-            plano_execucao.actions.append(self.get_acao_criar_vm())
-            return
-
-        # Alteração de network é possível recuperar TODO #18
-        if self.networks != vm_remota.networks:
+        if self.is_recriacao_necessaria(vm_remota):
             plano_execucao.actions.append(vm_remota.get_acao_excluir_vm())
             plano_execucao.actions.append(self.get_acao_criar_vm())
             return
@@ -170,25 +185,25 @@ class VM:
             vm_name=self.name
         )
 
-    def get_acao_mover_vm_regiao(self, region_host_id):
+    def get_acao_mover_vm_regiao(self, region_host_id, vm_id=None):
         return Action(
             'move_vm_region',
-            vm_name=self.name,
+            **Action.get_identificadores_recurso(self.name, vm_id),
             region_host_id=region_host_id,
             region=self.region
         )
 
-    def get_acao_atualizar_virtualizacao_aninhada(self):
+    def get_acao_atualizar_virtualizacao_aninhada(self, vm_id=None):
         return Action(
             'update_nested_virtualization',
-            vm_name=self.name,
+            **Action.get_identificadores_recurso(self.name, vm_id),
             nested_virtualization=self.nested_virtualization
         )
 
-    def get_acao_atualizar_memoria_dinamica(self):
+    def get_acao_atualizar_memoria_dinamica(self, vm_id=None):
         return Action(
             'update_dynamic_memory',
-            vm_name=self.name,
+            **Action.get_identificadores_recurso(self.name, vm_id),
             dynamic_memory=self.dynamic_memory
         )
 
@@ -244,7 +259,7 @@ class VM:
             'memory': self.memory,
             'networks': [network.to_dict() for network in self.networks],
             'vmm_id': self.vmm_id,
-            'status': self.status.value,
+            'status': self.status.value if self.status else None,
             'region_host': self.region_host,
             'ansible': [data_ansible.to_dict()
                         for data_ansible in self.dados_ansible.values()]
@@ -254,4 +269,8 @@ class VM:
             dict_objeto['additional_disks'] = [data_disco.to_dict()
                                                for data_disco in self.additional_disks.values()]
 
+        if self.to_json_campos:
+            return {campo: valor for campo, valor in dict_objeto.items()
+                    if campo == 'name' or campo in self.to_json_campos}
+
         return dict_objeto
@@ -43,10 +43,10 @@ class VMDisk:
     def get_tamanho_tipo_create(self):
         return self.size_type.name
 
-    def get_acao_criar_disco(self, vm_name):
+    def get_acao_criar_disco(self, vm_name, vm_id=None):
         return Action(
             'create_vm_disk',
-            vm_name=vm_name,
+            **Action.get_identificadores_recurso(vm_name, vm_id),
             bus_type=self.bus_type.value,
             size_mb=self.size_mb,
             size_type=self.get_tamanho_tipo_create(),
@@ -89,14 +89,16 @@ class VMDisk:
             size_type=self.get_tamanho_tipo_create()
         )
 
-    def get_acoes_diferenca_disco(self, disco_remoto: Self, vm_id, vm_name):
+    def get_acoes_diferenca_disco(self, disco_remoto: Self, vm_id, vm_name, vm_id_criacao):
+        # vm_id_criacao é None quando a VM será recriada no plano: o disco novo
+        # é criado na VM localizada pelo nome
         actions = []
 
         # Alteração de tipo ou redução de disco exige a recriação
         if ((self.bus_type != disco_remoto.bus_type) or
                 (self.size_mb + self.DISK_SIZE_TOLERANCE_BEFORE_REDUCE_MB < disco_remoto.size_mb)):
             actions.append(disco_remoto.get_acao_excluir_disco(vm_id, vm_name))
-            actions.append(self.get_acao_criar_disco(vm_name))
+            actions.append(self.get_acao_criar_disco(vm_name, vm_id_criacao))
         else:
             # Type de tamanho alterado: converter disco
             if self.size_type != disco_remoto.size_type:
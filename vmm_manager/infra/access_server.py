@@ -1,13 +1,26 @@
 """
 Módulo relacionado ao servidor que executará os comandos PowerShell
 """
+import base64
+import codecs
+import hashlib
+import io
 import os
 import re
 import socket
-import tempfile
+import threading
+import uuid
+from contextlib import nullcontext
 
 import paramiko
 
+from vmm_manager.infra.command import Command
+from vmm_manager.infra.powershell_session import PowerShellSession
+from vmm_manager.util.timing import (ETAPA_CONEXAO, ETAPA_DECODIFICACAO,
+                                     ETAPA_ENVIO, ETAPA_EXECUCAO,
+                                     ETAPA_PROCESSAMENTO, ETAPA_SERVIDOR,
+                                     ETAPA_SESSAO, ServerTimingFilter)
+
 
 def escapar_echo_cmd(conteudo):
     conteudo_escapado = re.sub(
@@ -16,33 +29,98 @@ def escapar_echo_cmd(conteudo):
     return conteudo_escapado
 
 
+class OutputBuffer:
+    # Guarda o texto recebido até o limite; o excedente é descartado e contado,
+    # mas quem escreve continua drenando o canal, que assim não fica bloqueado
+
+    def __init__(self, limite):
+        self.limite = limite
+        self.partes = []
+        self.tamanho = 0
+        self.descartado = 0
+
+    def adicionar(self, texto):
+        armazenado = max(0, min(len(texto), self.limite - self.tamanho))
+        if armazenado:
+            self.partes.append(texto[:armazenado])
+            self.tamanho += armazenado
+        self.descartado += len(texto) - armazenado
+
+    def get_texto(self):
+        return ''.join(self.partes)
+
+
 class AccessServer:
+    MODO_STDIN = 'stdin'
+    MODO_ARQUIVO = 'file'
+    MODO_SESSAO = 'session'
+    MODOS_EXECUCAO = [MODO_STDIN, MODO_ARQUIVO, MODO_SESSAO]
+    # O OpenSSH do Windows aceita, por padrão, até 10 canais por conexão (MaxSessions)
+    MAX_CANAIS_PADRAO = 8
+    # Limites (em caracteres) do que é guardado em memória: a saída sem
+    # ao_receber_saida e as mensagens de erro
+    TAMANHO_MAXIMO_SAIDA = 64 * 1024 * 1024
+    TAMANHO_MAXIMO_ERRO = 64 * 1024
+    # Tempo máximo (s) sem resposta da sessão PowerShell: depois dele a sessão é descartada
+    TIMEOUT_SESSAO = 30 * 60
+
     __PASTA_TEMPORARIA = 'vmm_temp'
     __ENCODE_CMD = 'cp850'
     __ENCODE_WINDOWS = 'iso-8859-1'
     __TIMEOUT_CONEXAO = 120
     __DEFAULT_SSH_PORT = 22
+    __INTERVALO_KEEPALIVE = 30
+    __TAMANHO_BLOCO_LEITURA = 32 * 1024
+    # Scripts maiores que esse limite são enviados por arquivo (SFTP)
+    __TAMANHO_MAXIMO_STDIN = 512 * 1024
+    __CMD_POWERSHELL_STDIN = (
+        'powershell.exe -NonInteractive -Command "iex ([Text.Encoding]::UTF8.GetString('
+        '[Convert]::FromBase64String([Console]::In.ReadToEnd())))"')
 
     @staticmethod
     def __get_caminho_arquivo(name):
         return f'{AccessServer.__PASTA_TEMPORARIA}/{os.path.basename(name)}'
 
-    def __init__(self, servidor, usuario, senha, vmm_server):
+    # pylint: disable=too-many-arguments
+    def __init__(self, servidor, usuario, senha, vmm_server,
+                 modo_execucao=MODO_STDIN, max_canais=MAX_CANAIS_PADRAO,
+                 compactar_saida=False, relatorio_tempos=None):
         self.servidor = servidor
         self.vmm_server = vmm_server
         self.usuario = usuario
         self.senha = senha
+        self.modo_execucao = modo_execucao
+        self.max_canais = max_canais
+        self.compactar_saida = compactar_saida
+        self.relatorio_tempos = relatorio_tempos
 
         self.conexao = None
         self.conexao_sftp = None
+        self.qtde_handshakes = 0
+        self.__sessoes_livres = []
+        self.__semaforo_canais = threading.BoundedSemaphore(max_canais)
+        self.__lock_conexao = threading.RLock()
+        self.__lock_sftp = threading.Lock()
+        self.__pasta_temporaria_criada = False
+        self.__scripts_em_cache = set()
+        self.__corpos_executados_stdin = set()
+        self.__lock_corpos_stdin = threading.Lock()
         self.__msg_erro_conexao = None
         self.__msg_erro_conexao_sftp = None
 
     def __del__(self):
-        if self.conexao:
-            self.conexao.close()
-        if self.conexao_sftp:
-            self.conexao_sftp.close()
+        self.fechar()
+
+    def fechar(self):
+        with self.__lock_conexao:
+            while self.__sessoes_livres:
+                self.__sessoes_livres.pop().fechar()
+            if self.conexao_sftp:
+                self.conexao_sftp.close()
+                self.conexao_sftp = None
+            if self.conexao:
+                self.conexao.close()
+                self.conexao = None
 
     def get_msg_erro_conexao(self):
         if self.__msg_erro_conexao:
@@ -55,13 +133,40 @@ class AccessServer:
                     f'with the access server. {self.__msg_erro_conexao_sftp}')
         return None
 
+    @staticmethod
+    def __get_msg_saida_excedida():
+        return (f'The script output exceeded {AccessServer.TAMANHO_MAXIMO_SAIDA} characters '
+                'and was discarded.')
+
+    def get_msg_estatisticas_conexao(self):
+        return f'SSH handshakes: {self.qtde_handshakes}'
+
+    def __medir(self, etapa):
+        if self.relatorio_tempos:
+            return self.relatorio_tempos.medir(etapa)
+        return nullcontext()
+
+    def __is_transporte_ativo(self):
+        if not self.conexao:
+            return False
+
+        transporte = self.conexao.get_transport()
+        return transporte is not None and transporte.is_active()
+
     def __is_conexao_ok(self):
-        if self.conexao:
-            self.conexao.close()
-        self.__conectar()
-        return not self.__msg_erro_conexao
+        # A conexão é mantida entre os comandos: só reconecta após uma falha real
+        with self.__lock_conexao:
+            if self.__is_transporte_ativo():
+                return True
+
+            self.fechar()
+            with self.__medir(ETAPA_CONEXAO):
+                self.__conectar()
+            return not self.__msg_erro_conexao
 
     def __conectar(self):
+        self.__msg_erro_conexao = None
+        self.qtde_handshakes += 1
         try:
             self.conexao = paramiko.SSHClient()
             self.conexao.load_system_host_keys()
@@ -70,7 +175,10 @@ class AccessServer:
                                  port=self.__DEFAULT_SSH_PORT,
                                  username=self.usuario,
                                  password=self.senha,
+                                 compress=self.compactar_saida,
                                  banner_timeout=AccessServer.__TIMEOUT_CONEXAO)
+            self.conexao.get_transport().set_keepalive(
+                AccessServer.__INTERVALO_KEEPALIVE)
         except paramiko.AuthenticationException:
             self.__msg_erro_conexao = 'User or password invalid.'
         except paramiko.SSHException as ex:
@@ -79,12 +187,14 @@ class AccessServer:
             self.__msg_erro_conexao = f'Socket error: {ex}'
 
     def __is_conexao_sftp_ok(self):
-        if self.conexao_sftp:
-            self.conexao_sftp.close()
+        if self.conexao_sftp and not self.conexao_sftp.get_channel().closed:
+            return True
+
         self.__conectar_sftp()
         return not self.__msg_erro_conexao_sftp
 
     def __conectar_sftp(self):
+        self.__msg_erro_conexao_sftp = None
         try:
             self.conexao_sftp = self.conexao.open_sftp()
         except paramiko.AuthenticationException:
@@ -94,15 +204,23 @@ class AccessServer:
         except (socket.error, socket.timeout) as ex:
             self.__msg_erro_conexao_sftp = f'Socket error: {ex}'
 
-    def __executar_comando(self, cmd):
+    def __drenar_fluxo(self, ler_bloco, consumidor):
+        decodificador = codecs.getincrementaldecoder(AccessServer.__ENCODE_CMD)()
+
+        while True:
+            dados = ler_bloco(AccessServer.__TAMANHO_BLOCO_LEITURA)
+            with self.__medir(ETAPA_DECODIFICACAO):
+                texto = decodificador.decode(dados, final=not dados)
+            if texto:
+                consumidor(texto)
+            if not dados:
+                break
+
+    def __executar_comando(self, cmd, entrada=None, ao_receber_saida=None):
         if self.__is_conexao_ok():
             try:
-                _, stdout, stderr = self.conexao.exec_command(cmd)
-                stderr_msg = stderr.read().decode(AccessServer.__ENCODE_CMD)
-                if stdout.channel.recv_exit_status() != 0 or stderr_msg:
-                    return False, stderr_msg
-
-                return True, stdout.read().decode(AccessServer.__ENCODE_CMD)
+                with self.__medir(ETAPA_EXECUCAO):
+                    return self.__executar_comando_canal(cmd, entrada, ao_receber_saida)
             except paramiko.SSHException as ex:
                 return False, f"Error to execute '{cmd}': {ex}"
             except socket.error as ex:
@@ -110,62 +228,286 @@ class AccessServer:
         else:
             return False, self.get_msg_erro_conexao()
 
-    def __enviar_arquivo(self, nome_arquivo):
-        resultado = self.__executar_comando(
-            f'if not exist "{AccessServer.__PASTA_TEMPORARIA}" '
-            f'mkdir "{AccessServer.__PASTA_TEMPORARIA}"')
+    def __executar_comando_canal(self, cmd, entrada, ao_receber_saida):
+        stdin, stdout, _ = self.conexao.exec_command(cmd)
+        canal = stdout.channel
+        if entrada is not None:
+            stdin.write(entrada)
+            canal.shutdown_write()
+
+        # stdout e stderr drenados ao mesmo tempo: se um deles não for lido,
+        # a janela do canal enche e o comando remoto fica bloqueado
+        erro = OutputBuffer(AccessServer.TAMANHO_MAXIMO_ERRO)
+        leitor_erro = threading.Thread(
+            target=self.__drenar_fluxo,
+            args=(canal.recv_stderr, erro.adicionar), daemon=True)
+        leitor_erro.start()
+
+        saida = OutputBuffer(AccessServer.TAMANHO_MAXIMO_SAIDA)
+        self.__drenar_fluxo(
+            canal.recv, ao_receber_saida or saida.adicionar)
+        leitor_erro.join()
+
+        stderr_msg = erro.get_texto()
+        if erro.descartado:
+            stderr_msg += f'\n[{erro.descartado} characters of stderr truncated]'
+        if canal.recv_exit_status() != 0 or stderr_msg:
+            return False, stderr_msg
+
+        if saida.descartado:
+            return False, AccessServer.__get_msg_saida_excedida()
+
+        return True, saida.get_texto()
+
+    def __criar_pasta_temporaria(self):
+        with self.__lock_conexao:
+            if self.__pasta_temporaria_criada:
+                return True, None
+
+            resultado = self.__executar_comando(
+                f'if not exist "{AccessServer.__PASTA_TEMPORARIA}" '
+                f'mkdir "{AccessServer.__PASTA_TEMPORARIA}"')
+            self.__pasta_temporaria_criada = resultado[0]
 
-        if not resultado[0]:
             return resultado
 
-        if self.__is_conexao_sftp_ok():
-            file_attrs = self.conexao_sftp.put(
-                nome_arquivo,
-                AccessServer.__get_caminho_arquivo(
-                    nome_arquivo
-                ),
-                confirm=True
-            )
-            return True, file_attrs
+    def __enviar_arquivo(self, caminho_arquivo, conteudo):
+        # Chamado com o lock do SFTP: o cliente SFTP não é thread-safe
+        if not self.__is_conexao_sftp_ok():
+            return False, self.get_msg_erro_conexao_sftp()
+
+        with self.__medir(ETAPA_ENVIO):
+            self.conexao_sftp.putfo(
+                io.BytesIO(conteudo), caminho_arquivo, confirm=True)
+        return True, None
+
+    def __enviar_script_temporario(self, caminho_arquivo, conteudo):
+        with self.__lock_sftp:
+            return self.__enviar_arquivo(caminho_arquivo, conteudo)
+
+    def __excluir_arquivo(self, caminho_arquivo):
+        with self.__lock_sftp:
+            try:
+                self.conexao_sftp.remove(caminho_arquivo)
+            except (OSError, paramiko.SSHException):
+                # Como no del do cmd, a falha na exclusão não altera o resultado do script
+                pass
+
+    def __enviar_script_cache(self, caminho_arquivo, conteudo):
+        with self.__lock_sftp:
+            if caminho_arquivo in self.__scripts_em_cache:
+                return True, None
+
+            if not self.__is_conexao_sftp_ok():
+                return False, self.get_msg_erro_conexao_sftp()
 
-        return False, self.get_msg_erro_conexao_sftp()
+            # O corpo pode ter sido enviado em uma execução anterior
+            try:
+                enviado = self.conexao_sftp.stat(caminho_arquivo).st_size == len(conteudo)
+            except FileNotFoundError:
+                enviado = False
+
+            if not enviado:
+                res_envio = self.__enviar_arquivo(caminho_arquivo, conteudo)
+                if not res_envio[0]:
+                    return res_envio
 
-    def __excluir_arquivo(self, name):
-        self.__executar_comando('del {}'.format(
-            AccessServer.__get_caminho_arquivo(name).replace('/', '\\')))
+            self.__scripts_em_cache.add(caminho_arquivo)
+            return True, None
 
     def get_caminho_lockfile(self, group, cloud):
         return self.__get_caminho_arquivo(f'{group}-{cloud}.lock')
 
-    def executar_script(self, name, conteudo):
+    def __executar_script_stdin(self, conteudo, ao_receber_saida, parametros):
+        if parametros is not None:
+            conteudo = Command.get_cmd_parametros(parametros) + '\n' + conteudo
+        conteudo_codificado = base64.b64encode(conteudo.encode('utf-8'))
+        return self.__executar_comando(
+            AccessServer.__CMD_POWERSHELL_STDIN, conteudo_codificado, ao_receber_saida)
+
+    @staticmethod
+    def __get_leitor_erro_sessao(canal):
+        # O timeout do canal vale também para o stderr, que pode ficar muito tempo
+        # sem dados: a leitura só termina quando o canal é fechado
+        def ler_bloco(tamanho):
+            while True:
+                try:
+                    return canal.recv_stderr(tamanho)
+                except socket.timeout:
+                    if canal.closed:
+                        return b''
+
+        return ler_bloco
+
+    def __iniciar_sessao(self):
+        conteudo_worker = Command(
+            'session_worker', vmm_server=self.vmm_server,
+            max_scripts=PowerShellSession.MAX_SCRIPTS_EM_CACHE).renderizar()
+
+        canal = self.conexao.get_transport().open_session()
+        canal.settimeout(AccessServer.TIMEOUT_SESSAO)
+        canal.exec_command(
+            PowerShellSession.get_cmd_inicializacao(conteudo_worker))
+        sessao = PowerShellSession(canal, OutputBuffer(AccessServer.TAMANHO_MAXIMO_ERRO))
+
+        # Como em __executar_comando_canal, o stderr é drenado para que a janela
+        # do canal não encha e bloqueie o worker
+        threading.Thread(
+            target=self.__drenar_fluxo,
+            args=(AccessServer.__get_leitor_erro_sessao(canal), sessao.erro.adicionar),
+            daemon=True).start()
+
+        try:
+            status, msg = sessao.iniciar()
+        except BaseException:
+            sessao.fechar()
+            raise
+        if not status:
+            sessao.fechar()
+            return False, f'Error to start the PowerShell session: {msg}{sessao.get_msg_erro()}'
+
+        return True, sessao
+
+    def __obter_sessao(self):
+        with self.__lock_conexao:
+            while self.__sessoes_livres:
+                sessao = self.__sessoes_livres.pop()
+                if sessao.is_ativa():
+                    return True, sessao
+                sessao.fechar()
+
+        with self.__medir(ETAPA_SESSAO):
+            return self.__iniciar_sessao()
+
+    def __executar_script_sessao(self, conteudo, parametros):
+        status, sessao = self.__obter_sessao()
+        if not status:
+            return status, sessao
+
+        resultado = None
+        try:
+            with self.__medir(ETAPA_EXECUCAO):
+                resultado = sessao.executar(conteudo, parametros)
+        # pylint: disable=broad-except
+        except Exception as ex:
+            return False, f'Error in the PowerShell session: {ex}{sessao.get_msg_erro()}'
+        finally:
+            # Após qualquer falha (EOF, timeout, resposta malformada) o protocolo pode
+            # estar dessincronizado: a sessão é descartada e recriada na próxima execução
+            if resultado is None:
+                sessao.fechar()
+            else:
+                with self.__lock_conexao:
+                    self.__sessoes_livres.append(sessao)
+
+        return resultado
+
+    def __executar_script_arquivo(self, conteudo, ao_receber_saida):
+        # Script único: enviado, executado e excluído
+        caminho_arquivo = AccessServer.__get_caminho_arquivo(f'{uuid.uuid4().hex}.ps1')
+
+        res_envio_arquivo = self.__enviar_script_temporario(
+            caminho_arquivo, conteudo.encode(AccessServer.__ENCODE_WINDOWS))
+        if not res_envio_arquivo[0]:
+            return res_envio_arquivo
+
         try:
-            arquivo_script = None
+            return self.__executar_comando(
+                f'powershell.exe -file {caminho_arquivo}', ao_receber_saida=ao_receber_saida)
+        finally:
+            self.__excluir_arquivo(caminho_arquivo)
+
+    def __is_corpo_repetido_stdin(self, conteudo, parametros):
+        # No modo stdin, um corpo fixo é enviado inteiro apenas na primeira execução;
+        # a partir da segunda, passa a ser executado do arquivo em cache
+        if parametros is None:
+            return False
+        hash_conteudo = hashlib.sha256(conteudo.encode(AccessServer.__ENCODE_WINDOWS)).hexdigest()
+        with self.__lock_corpos_stdin:
+            if hash_conteudo in self.__corpos_executados_stdin:
+                return True
+            self.__corpos_executados_stdin.add(hash_conteudo)
+            return False
+
+    def __executar_script_arquivo_parametrizado(self, conteudo, ao_receber_saida, parametros):
+        # Corpos fixos de templates são armazenados pelo hash do conteúdo e enviados
+        # uma única vez; cada chamada passa só os parâmetros, na linha de comando
+        conteudo_bytes = conteudo.encode(AccessServer.__ENCODE_WINDOWS)
+        caminho_arquivo = AccessServer.__get_caminho_arquivo(
+            f'{hashlib.sha256(conteudo_bytes).hexdigest()}.ps1')
 
-            if self.__is_conexao_ok():
-                with tempfile.NamedTemporaryFile(
-                        prefix=name, suffix='.ps1', delete=True) as arquivo_script:
-                    arquivo_script.file.write(conteudo.encode(
-                        AccessServer.__ENCODE_WINDOWS))
-                    arquivo_script.flush()
+        res_envio_arquivo = self.__enviar_script_cache(
+            caminho_arquivo, conteudo_bytes)
+        if not res_envio_arquivo[0]:
+            return res_envio_arquivo
 
-                    res_envio_arquivo = self.__enviar_arquivo(
-                        arquivo_script.name)
-                    if not res_envio_arquivo[0]:
-                        return res_envio_arquivo
+        return self.__executar_comando(
+            f'powershell.exe -NonInteractive -Command "{Command.get_cmd_parametros(parametros)}; '
+            f"& './{caminho_arquivo}'\"", ao_receber_saida=ao_receber_saida)
 
-                    caminho_arquivo = AccessServer.__get_caminho_arquivo(
-                        arquivo_script.name)
-                    resultado = self.__executar_comando(
-                        f'powershell.exe -file {caminho_arquivo}')
+    def __executar_script_medido(self, name, conteudo, ao_receber_saida, parametros):
+        # O script é envolvido por um cronômetro no PowerShell, cujo resultado
+        # é retirado da saída antes de ser repassado
+        def processar_saida(texto):
+            with self.__medir(ETAPA_PROCESSAMENTO):
+                ao_receber_saida(texto)
 
-                    self.__excluir_arquivo(arquivo_script.name)
+        saida = OutputBuffer(AccessServer.TAMANHO_MAXIMO_SAIDA)
+        filtro = ServerTimingFilter(processar_saida if ao_receber_saida else saida.adicionar)
+        conteudo_medido = Command(
+            'script_timing', corpo=conteudo,
+            marcador=ServerTimingFilter.MARCADOR).renderizar()
 
-                    return resultado
+        with self.relatorio_tempos.medir_comando(name):
+            status, retorno = self.__executar_script(
+                conteudo_medido, filtro.alimentar, parametros)
+            tempo_servidor = filtro.finalizar()
+            if tempo_servidor is not None:
+                self.relatorio_tempos.registrar(ETAPA_SERVIDOR, tempo_servidor)
 
+        if status and not ao_receber_saida:
+            if saida.descartado:
+                return False, AccessServer.__get_msg_saida_excedida()
+            retorno = saida.get_texto()
+        return status, retorno
+
+    def __executar_script(self, conteudo, ao_receber_saida, parametros):
+        if not self.__is_conexao_ok():
             return False, self.get_msg_erro_conexao()
+
+        # A pasta temporária também guarda os arquivos de lock
+        res_pasta = self.__criar_pasta_temporaria()
+        if not res_pasta[0]:
+            return res_pasta
+
+        # Cada script em execução ocupa um canal da conexão
+        with self.__semaforo_canais:
+            if self.modo_execucao == AccessServer.MODO_SESSAO:
+                status, retorno = self.__executar_script_sessao(conteudo, parametros)
+                if status and ao_receber_saida:
+                    ao_receber_saida(retorno)
+                    return status, ''
+                return status, retorno
+
+            if (self.modo_execucao == AccessServer.MODO_STDIN
+                    and len(conteudo) <= AccessServer.__TAMANHO_MAXIMO_STDIN
+                    and not self.__is_corpo_repetido_stdin(conteudo, parametros)):
+                return self.__executar_script_stdin(conteudo, ao_receber_saida, parametros)
+
+            if parametros is not None:
+                return self.__executar_script_arquivo_parametrizado(
+                    conteudo, ao_receber_saida, parametros)
+            return self.__executar_script_arquivo(conteudo, ao_receber_saida)
+
+    def executar_script(self, name, conteudo, ao_receber_saida=None, parametros=None):
+        # Com ao_receber_saida, a saída é entregue em partes, à medida que chega,
+        # e não é retornada. Com parametros, conteudo é um corpo fixo que lê
+        # $parametros (Command.get_parametros)
+        try:
+            if self.relatorio_tempos:
+                return self.__executar_script_medido(
+                    name, conteudo, ao_receber_saida, parametros)
+            return self.__executar_script(conteudo, ao_receber_saida, parametros)
         # pylint: disable=broad-except
         except Exception as ex:
             return False, f'Error "{type(ex).__name__}" to execute script: {ex}'
-        finally:
-            if arquivo_script:
-                arquivo_script.close()
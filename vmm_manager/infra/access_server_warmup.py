@@ -0,0 +1,61 @@
+"""
+Módulo relacionado à preparação do servidor de acesso em segundo plano
+"""
+import threading
+
+from vmm_manager.util.msgs import imprimir_acao_corrente
+from vmm_manager.util.operation import validar_retorno_operacao_sem_lock
+
+
+class AccessServerWarmup:
+    # Executa as etapas de preparação (conexão SSH, teste de conexão e configuração
+    # do VMM) em uma thread, enquanto o inventário local é processado. Cada etapa é
+    # um par (descrição, função que retorna (status, msg)); o progresso só é
+    # exibido em aguardar, para não se misturar às mensagens do processamento local.
+    # A thread é daemon: se a execução terminar antes de aguardar (por exemplo,
+    # inventário local inválido), o processo não espera a conexão em andamento.
+
+    def __init__(self, etapas):
+        self.__finalizado = False
+        self.__cancelado = threading.Event()
+        self.__resultados = []
+        self.__erro = None
+        self.__thread = threading.Thread(
+            target=self.__executar_etapas, args=(etapas,), daemon=True)
+        self.__thread.start()
+
+    def __executar_etapas(self, etapas):
+        try:
+            for descricao, funcao in etapas:
+                if self.__cancelado.is_set():
+                    break
+
+                status, msg = funcao()
+                self.__resultados.append((descricao, status, msg))
+
+                # Etapas seguintes dependem do sucesso da anterior
+                if not status:
+                    break
+        # pylint: disable=broad-except
+        except Exception as ex:
+            self.__erro = ex
+
+    def is_em_andamento(self):
+        return self.__thread.is_alive()
+
+    def cancelar(self):
+        # A etapa em andamento não é interrompida, mas as seguintes não são iniciadas
+        self.__cancelado.set()
+
+    def aguardar(self, ocultar_progresso):
+        if self.__finalizado:
+            return
+
+        self.__finalizado = True
+        self.__thread.join()
+        if self.__erro:
+            raise self.__erro
+
+        for descricao, status, msg in self.__resultados:
+            imprimir_acao_corrente(descricao, ocultar_progresso)
+            validar_retorno_operacao_sem_lock(status, msg, ocultar_progresso)
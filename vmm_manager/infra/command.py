@@ -1,36 +1,218 @@
 """
 Módulo relacionado à preparação de comandos para execução no servidor de acesso
 """
+import base64
+import glob
+import hashlib
+import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-from jinja2 import Environment, FileSystemLoader, exceptions
+from jinja2 import (ChoiceLoader, Environment, FileSystemBytecodeCache,
+                    FileSystemLoader, ModuleLoader, exceptions)
 
 
 class Command:
     __TEMPLATES_DIR = '../includes/ps_templates'
     __TEMPLATES_EXTENSION = '.j2'
+    # Gerada no build (precompile_templates), não versionada
+    __TEMPLATES_COMPILADOS_DIR = '../includes/ps_templates_compiled'
+    __ARQUIVO_ASSINATURA = 'templates.sha256'
+    # Templates com corpo fixo: os argumentos de cada chamada são lidos de
+    # $parametros (JSON enviado à parte), e o corpo é reaproveitado no servidor
+    __TEMPLATES_PARAMETRIZADOS = {
+        'move_vm_region', 'create_vm_disk', 'update_dynamic_memory',
+        'update_nested_virtualization', 'delete_vm_disk', 'expand_vm_disk',
+        'convert_vm_disk', 'move_vm_disk',
+    }
+    # Argumentos iguais em todas as chamadas da execução: renderizados no corpo
+    __ARGS_CORPO = {
+        'vmm_server', 'cloud', 'group', 'field_group', 'field_id', 'field_image',
+        'field_region', 'field_network_default',
+    }
+    __ambiente_jinja = None
+
+    @staticmethod
+    def __get_caminho(caminho_relativo):
+        return os.path.normpath(os.path.join(os.path.dirname(__file__), caminho_relativo))
+
+    @staticmethod
+    def get_assinatura_templates():
+        hash_templates = hashlib.sha256()
+        for arquivo in sorted(glob.glob(os.path.join(
+                Command.__get_caminho(Command.__TEMPLATES_DIR),
+                '*' + Command.__TEMPLATES_EXTENSION))):
+            hash_templates.update(os.path.basename(arquivo).encode('utf-8') + b'\0')
+            with open(arquivo, 'rb') as template:
+                hash_templates.update(template.read() + b'\0')
+        return hash_templates.hexdigest()
+
+    @staticmethod
+    def __get_pasta_templates_compilados():
+        # Os módulos pré-compilados só são usados se correspondem aos templates
+        # atuais: em desenvolvimento, templates alterados são compilados na hora
+        pasta = Command.__get_caminho(Command.__TEMPLATES_COMPILADOS_DIR)
+        try:
+            with open(os.path.join(pasta, Command.__ARQUIVO_ASSINATURA),
+                      'r', encoding='ascii') as arquivo_assinatura:
+                if arquivo_assinatura.read().strip() == Command.get_assinatura_templates():
+                    return pasta
+        except FileNotFoundError:
+            pass
+        return None
+
+    @staticmethod
+    def criar_ambiente_jinja(pasta_templates_compilados=None):
+        loader = FileSystemLoader(Command.__get_caminho(Command.__TEMPLATES_DIR))
+        if pasta_templates_compilados:
+            loader = ChoiceLoader([ModuleLoader(pasta_templates_compilados), loader])
+
+        return Environment(
+            loader=loader,
+            bytecode_cache=FileSystemBytecodeCache(),
+            auto_reload=False,
+            cache_size=-1,
+            trim_blocks=True)
+
+    @staticmethod
+    def get_ambiente_jinja():
+        # Ambiente único no processo: cada template é compilado uma vez e mantido
+        # em memória, e o bytecode fica em disco para as próximas execuções
+        if Command.__ambiente_jinja is None:
+            Command.__ambiente_jinja = Command.criar_ambiente_jinja(
+                Command.__get_pasta_templates_compilados())
+        return Command.__ambiente_jinja
+
+    @staticmethod
+    def precompilar_templates(pasta_destino=None):
+        # Gera um módulo Python por template, carregado sem parse nem compilação
+        pasta_destino = pasta_destino or Command.__get_caminho(
+            Command.__TEMPLATES_COMPILADOS_DIR)
+        os.makedirs(pasta_destino, exist_ok=True)
+        for modulo_antigo in glob.glob(os.path.join(pasta_destino, 'tmpl_*.py')):
+            os.remove(modulo_antigo)
+
+        Command.criar_ambiente_jinja().compile_templates(
+            pasta_destino, zip=None, ignore_errors=False)
+
+        with open(os.path.join(pasta_destino, Command.__ARQUIVO_ASSINATURA),
+                  'w', encoding='ascii') as arquivo_assinatura:
+            arquivo_assinatura.write(Command.get_assinatura_templates())
+
+        return pasta_destino
+
+    @staticmethod
+    def get_cmd_parametros(parametros):
+        # Em base64, o JSON não depende das regras de aspas do PowerShell nem do cmd
+        parametros_codificados = base64.b64encode(
+            json.dumps(parametros, default=str).encode('utf-8')).decode('ascii')
+        return ('$parametros = ConvertFrom-Json ([Text.Encoding]::UTF8.GetString('
+                f"[Convert]::FromBase64String('{parametros_codificados}')))")
+
+    @staticmethod
+    def executar_concorrente(comandos, servidor_acesso):
+        # Comandos independentes, limitados aos canais do servidor de acesso.
+        # Os resultados são retornados na mesma ordem dos comandos.
+        if not comandos:
+            return []
+
+        with ThreadPoolExecutor(max_workers=servidor_acesso.max_canais) as executor:
+            return list(executor.map(
+                lambda cmd: cmd.executar(servidor_acesso), comandos))
 
     def __init__(self, command, description=None, **kwargs):
         try:
             self.command = command
             self.description = description if description else self.command
             self.args = kwargs
-            j2_env = Environment(
-                loader=FileSystemLoader(os.path.join(
-                    os.path.dirname(__file__), Command.__TEMPLATES_DIR)),
-                trim_blocks=True)
-            self.template = j2_env.get_template(
+            self.template = Command.get_ambiente_jinja().get_template(
                 self.command + Command.__TEMPLATES_EXTENSION)
         except exceptions.TemplateNotFound as ex:
             print(
                 f"Template '{ex}' not found for the command '{self.command}'.")
             sys.exit(1)
 
+    def is_parametrizado(self):
+        return self.command in Command.__TEMPLATES_PARAMETRIZADOS
+
+    def get_parametros(self):
+        if not self.is_parametrizado():
+            return None
+
+        return {arg: valor for arg, valor in self.args.items()
+                if arg not in Command.__ARGS_CORPO}
+
+    def renderizar_corpo(self):
+        # Sem os parâmetros: o mesmo texto para todas as chamadas do template
+        if not self.is_parametrizado():
+            return self.renderizar()
+
+        return self.template.render({arg: valor for arg, valor in self.args.items()
+                                     if arg in Command.__ARGS_CORPO})
+
+    def renderizar(self):
+        if not self.is_parametrizado():
+            return self.template.render(self.args)
+
+        return Command.get_cmd_parametros(self.get_parametros()) + '\n' + self.renderizar_corpo()
+
     def imprimir(self):
-        print('\n' + self.template.render(self.args) + '\n')
+        print('\n' + self.renderizar() + '\n')
 
-    def executar(self, servidor_acesso):
-        conteudo_script = self.template.render(self.args)
+    def executar(self, servidor_acesso, ao_receber_saida=None):
         return servidor_acesso.executar_script(
-            self.command, conteudo_script)
+            self.command, self.renderizar_corpo(), ao_receber_saida=ao_receber_saida,
+            parametros=self.get_parametros())
+
+
+class CommandBatch:
+    # Limite de comandos por lote, para manter os scripts em tamanho razoável
+    TAMANHO_LOTE = 50
+
+    @staticmethod
+    def dividir_em_lotes(comandos, tamanho_lote=TAMANHO_LOTE):
+        return [CommandBatch(comandos[inicio:inicio + tamanho_lote])
+                for inicio in range(0, len(comandos), tamanho_lote)]
+
+    def __init__(self, comandos, description=None):
+        self.comandos = comandos
+        self.description = description if description else \
+            ', '.join(cmd.description for cmd in self.comandos)
+
+    def renderizar(self):
+        return Command(
+            'command_batch',
+            corpos=[cmd.renderizar() for cmd in self.comandos]
+        ).renderizar()
+
+    def imprimir(self):
+        print('\n' + self.renderizar() + '\n')
+
+    def executar(self, servidor_acesso):
+        # Um resultado (status, retorno) por comando, na mesma ordem dos comandos
+        if not self.comandos:
+            return []
+
+        status, retorno = servidor_acesso.executar_script(
+            'command_batch', self.renderizar())
+
+        if status:
+            try:
+                resultados = json.loads(retorno)
+            except ValueError:
+                status, retorno = False, f'Invalid batch result: {retorno}'
+
+        # Um lote interrompido não pode deixar comandos sem resultado
+        if status and (not isinstance(resultados, list)
+                       or len(resultados) != len(self.comandos)):
+            status, retorno = False, (
+                f'Invalid batch result: expected {len(self.comandos)} results, '
+                f'got {len(resultados) if isinstance(resultados, list) else 1}.')
+
+        if not status:
+            return [(False, retorno)] * len(self.comandos)
+
+        return [(False, resultado.get('Stderr')) if resultado.get('Stderr')
+                else (True, resultado.get('Stdout'))
+                for resultado in resultados]
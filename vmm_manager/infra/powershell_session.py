@@ -0,0 +1,97 @@
+"""
+Módulo relacionado à sessão PowerShell de longa duração no servidor de acesso
+"""
+import base64
+import hashlib
+import json
+from collections import deque
+
+
+class PowerShellSession:
+    # Scripts guardados na sessão, descartados do mais antigo ao mais novo
+    # (session_worker.j2 aplica a mesma regra)
+    MAX_SCRIPTS_EM_CACHE = 64
+
+    __ENCODE_PROTOCOLO = 'ascii'
+    __HASH_SEM_CACHE = '-'
+
+    @staticmethod
+    def get_cmd_inicializacao(conteudo_worker):
+        conteudo_codificado = base64.b64encode(
+            conteudo_worker.encode('utf-16-le')).decode(PowerShellSession.__ENCODE_PROTOCOLO)
+        return f'powershell.exe -NonInteractive -EncodedCommand {conteudo_codificado}'
+
+    def __init__(self, canal, erro):
+        # erro: buffer alimentado com o stderr do worker (drenado pelo AccessServer)
+        self.canal = canal
+        self.erro = erro
+        self.__stdin = canal.makefile_stdin('wb')
+        self.__stdout = canal.makefile('rb')
+        self.__hashes_enviados = set()
+        self.__ordem_hashes = deque()
+
+    def is_ativa(self):
+        return not self.canal.closed and not self.canal.exit_status_ready()
+
+    def get_msg_erro(self):
+        texto = self.erro.get_texto().strip()
+        return f'\nPowerShell session stderr:\n{texto}' if texto else ''
+
+    def fechar(self):
+        if not self.canal.closed:
+            self.canal.close()
+
+    def __guardar_hash(self, hash_conteudo):
+        self.__hashes_enviados.add(hash_conteudo)
+        self.__ordem_hashes.append(hash_conteudo)
+        while len(self.__ordem_hashes) > PowerShellSession.MAX_SCRIPTS_EM_CACHE:
+            self.__hashes_enviados.discard(self.__ordem_hashes.popleft())
+
+    def __enviar_requisicao(self, conteudo, parametros):
+        conteudo_bytes = conteudo.encode('utf-8')
+
+        # Somente os corpos fixos (com parâmetros) são guardados na sessão:
+        # os demais scripts raramente se repetem
+        hash_conteudo = PowerShellSession.__HASH_SEM_CACHE
+        conteudo_codificado = base64.b64encode(conteudo_bytes)
+        parametros_codificados = b''
+        if parametros is not None:
+            hash_conteudo = hashlib.sha256(conteudo_bytes).hexdigest()
+            parametros_codificados = base64.b64encode(
+                json.dumps(parametros, default=str).encode('utf-8'))
+            # Scripts já enviados ficam compilados na sessão: basta o hash
+            if hash_conteudo in self.__hashes_enviados:
+                conteudo_codificado = b''
+            else:
+                self.__guardar_hash(hash_conteudo)
+
+        self.__stdin.write(f'{len(conteudo_codificado)} {hash_conteudo}\n'.encode(
+            PowerShellSession.__ENCODE_PROTOCOLO))
+        self.__stdin.write(conteudo_codificado + b'\n')
+        self.__stdin.write(parametros_codificados + b'\n')
+        self.__stdin.flush()
+
+    def __ler_resposta(self):
+        cabecalho = self.__stdout.readline().strip()
+        if not cabecalho:
+            raise EOFError('PowerShell session closed by the access server.')
+
+        conteudo_codificado = self.__stdout.read(int(cabecalho))
+        self.__stdout.readline()
+
+        return json.loads(base64.b64decode(conteudo_codificado).decode('utf-8'))
+
+    def iniciar(self):
+        # A primeira resposta indica se o módulo do VMM foi carregado
+        return self.__processar_resposta(self.__ler_resposta())
+
+    def executar(self, conteudo, parametros=None):
+        self.__enviar_requisicao(conteudo, parametros)
+        return self.__processar_resposta(self.__ler_resposta())
+
+    @staticmethod
+    def __processar_resposta(resposta):
+        if resposta.get('Stderr'):
+            return False, resposta.get('Stderr')
+
+        return True, resposta.get('Stdout')
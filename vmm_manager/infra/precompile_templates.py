@@ -0,0 +1,14 @@
+"""
+Pré-compila os templates PowerShell em módulos Python, distribuídos com o pacote.
+Executado no build: python -m vmm_manager.infra.precompile_templates
+"""
+from vmm_manager.infra.command import Command
+
+
+def main():
+    pasta_destino = Command.precompilar_templates()
+    print(f'Templates precompiled into {pasta_destino}')
+
+
+if __name__ == '__main__':
+    main()
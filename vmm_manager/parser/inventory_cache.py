@@ -0,0 +1,70 @@
+"""
+Cópia local dos registros do inventário remoto, com a versão (última
+alteração) de cada VM, para que apenas as VMs alteradas sejam consultadas
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from vmm_manager.infra.command import Command
+
+
+class InventoryCache:
+    VERSAO = 2
+
+    @staticmethod
+    def get_pasta_padrao():
+        pasta_cache_usuario = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache')
+        return os.path.join(pasta_cache_usuario, 'vmm_manager', 'inventory')
+
+    def __init__(self, pasta=None):
+        self.pasta = pasta or InventoryCache.get_pasta_padrao()
+
+    def __get_caminho(self, vmm_server, cloud, group):
+        chave = '/'.join([vmm_server, cloud, group]).lower()
+        return os.path.join(
+            self.pasta, f"{hashlib.sha256(chave.encode('utf-8')).hexdigest()}.json")
+
+    @staticmethod
+    def __get_identificacao():
+        # Registros gerados por outra versão dos templates não são reaproveitados
+        return {
+            'version': InventoryCache.VERSAO,
+            'templates': Command.get_assinatura_templates(),
+        }
+
+    def carregar(self, vmm_server, cloud, group, dados_completos):
+        # Retorna as versões das VMs, os registros e se a cópia tem os dados completos,
+        # ou None se não houver cópia válida
+        try:
+            with open(self.__get_caminho(vmm_server, cloud, group), 'r', encoding='utf8') as file:
+                conteudo = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(conteudo, dict) \
+                or conteudo.get('id') != InventoryCache.__get_identificacao():
+            return None
+
+        # Uma cópia com os dados completos também atende às consultas resumidas
+        if dados_completos and not conteudo.get('full_data'):
+            return None
+
+        return conteudo.get('versions'), conteudo.get('records'), bool(conteudo.get('full_data'))
+
+    # pylint: disable=too-many-arguments
+    def salvar(self, vmm_server, cloud, group, versoes, dados_completos, registros):
+        os.makedirs(self.pasta, exist_ok=True)
+
+        # Escrita atômica: execuções simultâneas nunca leem um arquivo incompleto
+        with tempfile.NamedTemporaryFile(
+                'w', encoding='utf8', dir=self.pasta, suffix='.tmp', delete=False) as file:
+            json.dump({
+                'id': InventoryCache.__get_identificacao(),
+                'full_data': dados_completos,
+                'versions': versoes,
+                'records': registros,
+            }, file)
+        os.replace(file.name, self.__get_caminho(vmm_server, cloud, group))
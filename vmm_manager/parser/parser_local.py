@@ -50,6 +50,7 @@ class ParserLocal:
     def __init__(self, inventory_file):
         self.__arquivo_inventario = inventory_file
         self.__inventario = None
+        self.__inventario_validado = False
 
     def __validar_arquivo_yaml(self):
         if not os.path.isfile(self.__arquivo_inventario):
@@ -133,7 +134,8 @@ class ParserLocal:
         return yamale.make_data(self.__arquivo_inventario,
                                 parser=ParserLocal.__YAML_PARSER)
 
-    def get_inventario(self, servidor_acesso, filtro_nome_vm=None, filtro_dados_completos=True):
+    def carregar_inventario(self, filtro_nome_vm=None, filtro_dados_completos=True):
+        # Etapa local (arquivo e schema), sem acesso ao servidor
         if not self.__inventario:
             try:
                 self.__validar_arquivo_yaml()
@@ -144,8 +146,23 @@ class ParserLocal:
 
                 self.__montar_inventario(
                     dados_yaml[0][0], filtro_nome_vm, filtro_dados_completos)
-                self.__inventario.validar(servidor_acesso)
+            except (SyntaxError, ValueError) as ex:
+                self.__inventario = None
+                return False, str(ex)
+
+        return True, self.__inventario
+
+    def get_inventario(self, servidor_acesso, filtro_nome_vm=None, filtro_dados_completos=True):
+        if not self.__inventario_validado:
+            status, inventario = self.carregar_inventario(
+                filtro_nome_vm, filtro_dados_completos)
+            if not status:
+                return status, inventario
+
+            try:
+                inventario.validar(servidor_acesso)
             except (SyntaxError, ValueError) as ex:
                 return False, str(ex)
+            self.__inventario_validado = True
 
         return True, self.__inventario
@@ -1,7 +1,7 @@
 """
 Módulo que realiza o parser de um inventário remoto (no SCVMM)
 """
-import json
+import functools
 
 from vmm_manager.entity.inventory import Inventory
 from vmm_manager.entity.vm import VM
@@ -12,42 +12,205 @@ from vmm_manager.scvmm.enums import SCDiskBusType, SCDiskSizeType, VMStatusEnum
 from vmm_manager.scvmm.scregion import SCRegion
 from vmm_manager.util.config import (FIELD_GROUP, FIELD_ID, FIELD_IMAGE,
                                      FIELD_NETWORK_DEFAULT, FIELD_REGION)
+from vmm_manager.util.json_stream import (GzipBase64StreamDecoder,
+                                          JsonArrayStreamParser,
+                                          NdjsonStreamParser)
 
 
 # pylint: disable=too-few-public-methods
 class ParserRemote:
+    # Campo do JSON (VM.CAMPOS_JSON) -> propriedades calculadas pelo PowerShell.
+    # ID e Name são sempre calculados; os discos dependem de dados completos.
+    __PROPRIEDADES_CAMPOS = {
+        'description': ['Description'],
+        'image': ['Image'],
+        'region': ['Region'],
+        'cpu': ['Cpu'],
+        'memory': ['Ram'],
+        'networks': ['Networks'],
+        'status': ['Status'],
+        'region_host': ['RegionHostname'],
+    }
 
     @staticmethod
-    def __get_regioes_disponiveis(servidor_acesso):
-        cmd = Command('get_available_regions',
-                      vmm_server=servidor_acesso.vmm_server)
-        status, regioes = cmd.executar(servidor_acesso)
+    def __is_saida_ndjson(servidor_acesso):
+        # A saída compactada só é gerada no fim do script: em NDJSON, cada VM é
+        # enviada (e processada aqui) enquanto o servidor ainda percorre as demais
+        return not servidor_acesso.compactar_saida
+
+    @staticmethod
+    def __executar_consulta(servidor_acesso, cmd, ao_receber_elemento, msg_erro,
+                            saida_ndjson=False):
+        # A saída JSON (compactada ou não) é processada à medida que chega
+        leitor_json = NdjsonStreamParser(ao_receber_elemento) if saida_ndjson \
+            else JsonArrayStreamParser(ao_receber_elemento)
+        decodificador = GzipBase64StreamDecoder(leitor_json.alimentar) \
+            if servidor_acesso.compactar_saida else None
+
+        status, retorno = cmd.executar(
+            servidor_acesso,
+            ao_receber_saida=decodificador.alimentar if decodificador else leitor_json.alimentar)
         if not status:
             raise Exception(  # pylint: disable=broad-exception-raised
-                f'Error getting available regions: {regioes}')
+                f'{msg_erro}: {retorno}')
+
+        if decodificador:
+            decodificador.finalizar()
+        leitor_json.finalizar()
+
+    @staticmethod
+    def __get_regioes_disponiveis(servidor_acesso):
+        cmd = Command('get_available_regions',
+                      vmm_server=servidor_acesso.vmm_server,
+                      compactar_saida=servidor_acesso.compactar_saida)
 
-        regioes_remoto = json.loads(regioes)
         regioes_disponiveis = []
-        for region in regioes_remoto:
-            regiao_obj = SCRegion(
-                region.get('HostID'),
-                region.get('Hostname'),
-                region.get('Group'),
-                region.get('Cluster')
-            )
+        try:
+            ParserRemote.__executar_consulta(
+                servidor_acesso, cmd,
+                lambda region: regioes_disponiveis.append(ParserRemote.__get_regiao(region)),
+                'Error getting available regions')
+        # pylint: disable=broad-except
+        except Exception as ex:
+            return False, str(ex)
+
+        return True, regioes_disponiveis
+
+    @staticmethod
+    def __get_provedor_regioes(servidor_acesso):
+        # Os hosts são consultados somente no primeiro uso de uma região, uma única
+        # vez mesmo que o provedor seja compartilhado entre inventários
+        return functools.lru_cache(maxsize=None)(
+            lambda: ParserRemote.__get_regioes_disponiveis(servidor_acesso))
+
+    @staticmethod
+    def __get_lista_powershell(valores):
+        return ','.join([f'"{valor}"' for valor in valores])
+
+    @staticmethod
+    def __get_propriedades_campos(campos):
+        return ['Name'] + sorted({propriedade for campo in campos
+                                  for propriedade in ParserRemote.__PROPRIEDADES_CAMPOS.get(campo, [])})
+
+    @staticmethod
+    def __get_cmd_inventario(servidor_acesso, cloud, **parametros):
+        return Command(
+            'get_inventory_snapshot',
+            vmm_server=servidor_acesso.vmm_server,
+            field_group=FIELD_GROUP[0],
+            field_id=FIELD_ID[0],
+            field_image=FIELD_IMAGE[0],
+            field_region=FIELD_REGION[0],
+            field_network_default=FIELD_NETWORK_DEFAULT[0],
+            cloud=cloud,
+            compactar_saida=servidor_acesso.compactar_saida,
+            saida_ndjson=ParserRemote.__is_saida_ndjson(servidor_acesso),
+            **parametros
+        )
+
+    @staticmethod
+    def get_inventarios_nuvem(servidor_acesso, cloud, groups, filtro_dados_completos=True):
+        # Uma única varredura da nuvem, repartida entre os grupos pelo campo de grupo
+        parsers = {group.lower(): ParserRemote(group, cloud) for group in groups}
+        for parser in parsers.values():
+            parser.__inventario = Inventory(parser.group, cloud)
 
-            regioes_disponiveis.append(regiao_obj)
+        def ao_receber_registro(registro):
+            parsers[registro.get('Group').lower()].__add_vm_inventario(registro)
 
-        return regioes_disponiveis
+        cmd = ParserRemote.__get_cmd_inventario(
+            servidor_acesso, cloud,
+            groups=ParserRemote.__get_lista_powershell(groups),
+            dados_completos=filtro_dados_completos)
+        try:
+            ParserRemote.__executar_consulta(
+                servidor_acesso, cmd, ao_receber_registro, 'Error getting VMs',
+                ParserRemote.__is_saida_ndjson(servidor_acesso))
+        # pylint: disable=broad-except
+        except Exception as ex:
+            return False, str(ex)
 
-    def __init__(self, group, cloud):
+        provedor_regioes = ParserRemote.__get_provedor_regioes(servidor_acesso)
+        inventarios = {}
+        for parser in parsers.values():
+            if filtro_dados_completos:
+                parser.__inventario.set_provedor_regioes(provedor_regioes)
+            inventarios[parser.group] = parser.__inventario
+
+        return True, inventarios
+
+    @staticmethod
+    def __get_regiao(region):
+        return SCRegion(
+            region.get('HostID'),
+            region.get('Hostname'),
+            region.get('Group'),
+            region.get('Cluster')
+        )
+
+    def __init__(self, group, cloud, cache_inventario=None):
         self.group = group
         self.cloud = cloud
+        self.__cache_inventario = cache_inventario
         self.__inventario = None
 
-    def __get_vms_servidor(self, servidor_acesso, filtro_nome_vm=None):
+    @staticmethod
+    def __get_ips(ips):
+        # Conforme a profundidade do ConvertTo-Json, os IPs chegam como lista ou como texto
+        if isinstance(ips, list):
+            return [str(ip) for ip in ips]
+        return (ips or '').split(' ')
+
+    def __add_vm_inventario(self, maquina_virtual):
+        # Com projeção de campos, as propriedades não consultadas ficam ausentes
+        vms_rede = []
+
+        for network in maquina_virtual.get('Networks') or []:
+            vm_rede = VMNetwork(network.get('Name'), network.get('Principal'))
+            vm_rede.ips = ParserRemote.__get_ips(network.get('IPS'))
+            vms_rede.append(vm_rede)
+
+        vm_obj = VM(
+            maquina_virtual.get('Name'),
+            bytearray(maquina_virtual.get('Description') or []).decode('utf-8'),  # convert utf-8 bytes to string
+            maquina_virtual.get('Image'),
+            maquina_virtual.get('Region'),
+            maquina_virtual.get('Cpu'),
+            maquina_virtual.get('Ram'),
+            vms_rede,
+            maquina_virtual.get('ID'),
+            maquina_virtual.get('NestedVirtualization'),
+            maquina_virtual.get('DynamicMemory'),
+            VMStatusEnum(maquina_virtual.get('Status')) if 'Status' in maquina_virtual else None,
+            maquina_virtual.get('RegionHostname'),
+        )
+        self.__inventario.vms[vm_obj.name] = vm_obj
+
+        if maquina_virtual.get('Discos'):
+            vm_obj.add_discos_adicionais(
+                ParserRemote.__get_discos_vm(maquina_virtual))
+
+    # pylint: disable=too-many-arguments
+    def __carregar_inventario_servidor(self, servidor_acesso, filtro_nome_vm=None,
+                                       filtro_dados_completos=True,
+                                       ao_receber_registro=None, filtro_ids=None, campos=None):
+        cmd = ParserRemote.__get_cmd_inventario(
+            servidor_acesso, self.cloud,
+            group=self.group,
+            filtro_nome_vm=filtro_nome_vm,
+            dados_completos=filtro_dados_completos,
+            filtro_ids=ParserRemote.__get_lista_powershell(filtro_ids or []),
+            propriedades=ParserRemote.__get_propriedades_campos(campos) if campos else None
+        )
+
+        # As VMs são montadas à medida que a saída chega
+        ParserRemote.__executar_consulta(
+            servidor_acesso, cmd, ao_receber_registro or self.__add_vm_inventario,
+            'Error getting VMs', ParserRemote.__is_saida_ndjson(servidor_acesso))
+
+    def __get_versoes_vms(self, servidor_acesso):
         cmd = Command(
-            'get_vms_in_group',
+            'get_inventory_fingerprint',
             vmm_server=servidor_acesso.vmm_server,
             field_group=FIELD_GROUP[0],
             field_id=FIELD_ID[0],
@@ -55,105 +218,110 @@ class ParserRemote:
             field_region=FIELD_REGION[0],
             field_network_default=FIELD_NETWORK_DEFAULT[0],
             group=self.group,
-            filtro_nome_vm=filtro_nome_vm,
-            cloud=self.cloud
+            cloud=self.cloud,
+            compactar_saida=servidor_acesso.compactar_saida,
+            saida_ndjson=ParserRemote.__is_saida_ndjson(servidor_acesso)
         )
 
-        status, vms = cmd.executar(servidor_acesso)
+        versoes = {}
+        ParserRemote.__executar_consulta(
+            servidor_acesso, cmd,
+            lambda versao: versoes.update({versao.get('ID'): versao.get('Version')}),
+            'Error getting the VM versions',
+            ParserRemote.__is_saida_ndjson(servidor_acesso))
 
-        if not status:
-            raise Exception(  # pylint: disable=broad-exception-raised
-                f'Error getting VMs: {vms}')
+        return versoes
 
-        return vms
+    def __montar_inventario_com_cache(self, servidor_acesso, filtro_nome_vm,
+                                      filtro_dados_completos):
+        # A cópia local guarda todas as VMs do grupo: o filtro por nome é aplicado aqui
+        versoes = self.__get_versoes_vms(servidor_acesso)
+        chave_cache = (servidor_acesso.vmm_server, self.cloud, self.group)
+        versoes_copia, registros_copia, copia_completa = self.__cache_inventario.carregar(
+            *chave_cache, filtro_dados_completos) or ({}, None, False)
+        # Uma cópia com os dados completos continua completa: as VMs alteradas
+        # são consultadas com os discos mesmo numa consulta resumida
+        dados_completos_copia = filtro_dados_completos or copia_completa
 
-    def __get_discos_adicionais(self, servidor_acesso):
-        cmd = Command('get_additional_disks',
-                      vmm_server=servidor_acesso.vmm_server,
-                      field_group=FIELD_GROUP[0],
-                      field_id=FIELD_ID[0],
-                      group=self.group,
-                      cloud=self.cloud,
-                      vm_nomes=','.join([f'"{vm_name}"' for vm_name in self.__inventario.vms]))
-        status, additional_disks = cmd.executar(servidor_acesso)
-        if not status:
-            raise Exception(  # pylint: disable=broad-exception-raised
-                f'Error getting additional disks: {additional_disks}')
+        # Somente as VMs criadas ou alteradas são consultadas; as removidas são descartadas
+        ids_alterados = {id_vm for id_vm, versao in versoes.items()
+                         if versoes_copia.get(id_vm) != versao}
+        registros = [registro for registro in registros_copia or []
+                     if registro.get('ID') in versoes and registro.get('ID') not in ids_alterados]
+        if ids_alterados:
+            # Sem nada a reaproveitar, todas as VMs do grupo são consultadas, sem filtro
+            self.__carregar_inventario_servidor(
+                servidor_acesso, filtro_dados_completos=dados_completos_copia,
+                ao_receber_registro=registros.append,
+                filtro_ids=sorted(ids_alterados) if registros else None)
+
+        # VMs que sumiram durante a consulta ficam sem versão e são consultadas de novo
+        versoes_registros = {registro.get('ID'): versoes.get(registro.get('ID'))
+                             for registro in registros}
+        if registros_copia is None or versoes_registros != versoes_copia:
+            self.__cache_inventario.salvar(
+                *chave_cache, versoes_registros, dados_completos_copia, registros)
 
-        discos_vms_remoto = json.loads(additional_disks)
-        discos_vms = {}
-        for maquina_virtual in discos_vms_remoto:
-            vm_name = maquina_virtual.get('Name')
-            discos_vms[vm_name] = []
+        for registro in registros:
+            if not filtro_nome_vm or registro.get('Name', '').upper() == filtro_nome_vm.upper():
+                self.__add_vm_inventario(
+                    registro if filtro_dados_completos
+                    else {campo: valor for campo, valor in registro.items() if campo != 'Discos'})
 
-            for disco_remoto in maquina_virtual.get('Discos'):
-                disco = VMDisk(
-                    SCDiskBusType(disco_remoto.get('Type')),
-                    disco_remoto.get('File'),
-                    disco_remoto.get('SizeMB'),
-                    SCDiskSizeType(disco_remoto.get('SizeType')),
-                    disco_remoto.get('Path'))
+    @staticmethod
+    def __get_discos_vm(maquina_virtual):
+        discos = []
 
-                disco.set_parametros_extras_vmm(
-                    disco_remoto.get('DriveID'),
-                    disco_remoto.get('DiskID'),
-                    disco_remoto.get('Bus'),
-                    disco_remoto.get('Lun'),
-                )
+        for disco_remoto in maquina_virtual.get('Discos'):
+            disco = VMDisk(
+                SCDiskBusType(disco_remoto.get('Type')),
+                disco_remoto.get('File'),
+                disco_remoto.get('SizeMB'),
+                SCDiskSizeType(disco_remoto.get('SizeType')),
+                disco_remoto.get('Path'))
 
-                discos_vms[vm_name].append(disco)
+            disco.set_parametros_extras_vmm(
+                disco_remoto.get('DriveID'),
+                disco_remoto.get('DiskID'),
+                disco_remoto.get('Bus'),
+                disco_remoto.get('Lun'),
+            )
 
-        return discos_vms
+            discos.append(disco)
+
+        return discos
 
     def __montar_inventario(
         self,
         servidor_acesso,
         filtro_nome_vm=None,
-        filtro_dados_completos=True
+        filtro_dados_completos=True,
+        campos=None
     ):
         self.__inventario = Inventory(self.group, self.cloud)
 
-        vms_servidor = json.loads(
-            self.__get_vms_servidor(servidor_acesso, filtro_nome_vm) or '{}')
-
-        for maquina_virtual in vms_servidor:
-            vms_rede = []
-
-            for network in maquina_virtual.get('Networks'):
-                vm_rede = VMNetwork(network.get('Name'), network.get('Principal'))
-                vm_rede.ips = network.get('IPS', '').split(' ')
-                vms_rede.append(vm_rede)
-
-            self.__inventario.vms[maquina_virtual.get('Name')] = VM(
-                maquina_virtual.get('Name'),
-                bytearray(maquina_virtual.get('Description')).decode('utf-8'),  # convert utf-8 bytes to string
-                maquina_virtual.get('Image'),
-                maquina_virtual.get('Region'),
-                maquina_virtual.get('Cpu'),
-                maquina_virtual.get('Ram'),
-                vms_rede,
-                maquina_virtual.get('ID'),
-                maquina_virtual.get('NestedVirtualization'),
-                maquina_virtual.get('DynamicMemory'),
-                VMStatusEnum(maquina_virtual.get('Status')),
-                maquina_virtual.get('RegionHostname'),
-            )
+        # A cópia local guarda as VMs completas: a projeção vale só para a consulta direta
+        if self.__cache_inventario:
+            self.__montar_inventario_com_cache(
+                servidor_acesso, filtro_nome_vm, filtro_dados_completos)
+        elif campos:
+            self.__carregar_inventario_servidor(
+                servidor_acesso, filtro_nome_vm, 'additional_disks' in campos,
+                campos=campos)
+        else:
+            self.__carregar_inventario_servidor(
+                servidor_acesso, filtro_nome_vm, filtro_dados_completos)
 
-        # Obtendo dados adicionais
         if filtro_dados_completos:
-            # discos
-            self.__inventario.set_discos_vms(
-                self.__get_discos_adicionais(servidor_acesso))
-
-            # regioes
-            self.__inventario.set_regioes_disponiveis(
-                ParserRemote.__get_regioes_disponiveis(servidor_acesso))
+            self.__inventario.set_provedor_regioes(
+                ParserRemote.__get_provedor_regioes(servidor_acesso))
 
-    def get_inventario(self, servidor_acesso, filtro_nome_vm=None, filtro_dados_completos=True):
+    def get_inventario(self, servidor_acesso, filtro_nome_vm=None, filtro_dados_completos=True,
+                       campos=None):
         if not self.__inventario:
             try:
                 self.__montar_inventario(
-                    servidor_acesso, filtro_nome_vm, filtro_dados_completos)
+                    servidor_acesso, filtro_nome_vm, filtro_dados_completos, campos)
             # pylint: disable=broad-except
             except Exception as ex:
                 return False, str(ex)
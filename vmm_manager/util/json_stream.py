@@ -0,0 +1,162 @@
+"""
+Incremental JSON parsing of remote outputs.
+"""
+
+import base64
+import codecs
+import json
+import re
+import zlib
+
+_REGEX_CARACTERES_ESTRUTURAIS = re.compile(r'["\\\[\]{},]')
+_REGEX_ESPACOS = re.compile(r'\s+')
+
+
+class JsonArrayStreamParser:
+    # Recebe o texto de um array JSON em partes e entrega cada elemento assim que ele é
+    # concluído, sem manter o documento inteiro em memória. Um objeto fora de array
+    # (ConvertTo-Json com um único item) é entregue como elemento único.
+
+    def __init__(self, ao_receber_elemento):
+        self.qtde_elementos = 0
+
+        self.__ao_receber_elemento = ao_receber_elemento
+        self.__partes_elemento = []
+        self.__profundidade = 0
+        self.__is_array = None
+        self.__em_string = False
+        self.__escape_pendente = False
+
+    def __entregar_elemento(self, texto_elemento):
+        if texto_elemento.strip():
+            self.__ao_receber_elemento(json.loads(texto_elemento))
+            self.qtde_elementos += 1
+
+    def __fechar_elemento(self, texto, inicio, fim):
+        self.__partes_elemento.append(texto[inicio:fim])
+        texto_elemento = ''.join(self.__partes_elemento)
+        self.__partes_elemento = []
+        self.__entregar_elemento(texto_elemento)
+
+    # pylint: disable=too-many-branches
+    def alimentar(self, texto):
+        inicio = 0
+        ignorar_ate = 1 if self.__escape_pendente else 0
+        self.__escape_pendente = False
+
+        for ocorrencia in _REGEX_CARACTERES_ESTRUTURAIS.finditer(texto):
+            posicao = ocorrencia.start()
+            if posicao < ignorar_ate:
+                continue
+
+            caractere = texto[posicao]
+
+            if self.__em_string:
+                if caractere == '"':
+                    self.__em_string = False
+                elif caractere == '\\':
+                    ignorar_ate = posicao + 2
+                    self.__escape_pendente = ignorar_ate > len(texto)
+            elif caractere == '"':
+                self.__em_string = True
+            elif caractere in '[{':
+                if self.__is_array is None:
+                    self.__is_array = caractere == '['
+                    if self.__is_array:
+                        self.__profundidade = 1
+                        inicio = posicao + 1
+                        continue
+                    inicio = posicao
+                self.__profundidade += 1
+            elif caractere in ']}':
+                self.__profundidade -= 1
+                if self.__profundidade == 0:
+                    fim = posicao if self.__is_array else posicao + 1
+                    self.__fechar_elemento(texto, inicio, fim)
+                    inicio = posicao + 1
+            elif caractere == ',' and self.__is_array and self.__profundidade == 1:
+                self.__fechar_elemento(texto, inicio, posicao)
+                inicio = posicao + 1
+
+        if self.__profundidade > 0:
+            self.__partes_elemento.append(texto[inicio:])
+
+    def finalizar(self):
+        if self.__profundidade > 0:
+            raise ValueError('Incomplete JSON document.')
+
+
+class NdjsonStreamParser:
+    # Recebe, em partes, uma saída com um objeto JSON compacto por linha (NDJSON)
+    # e entrega cada objeto assim que a sua linha é concluída
+
+    def __init__(self, ao_receber_elemento):
+        self.qtde_elementos = 0
+
+        self.__ao_receber_elemento = ao_receber_elemento
+        self.__linha_pendente = ''
+
+    def __entregar_linha(self, linha):
+        if linha.strip():
+            self.__ao_receber_elemento(json.loads(linha))
+            self.qtde_elementos += 1
+
+    def alimentar(self, texto):
+        linhas = (self.__linha_pendente + texto).split('\n')
+        self.__linha_pendente = linhas.pop()
+
+        for linha in linhas:
+            self.__entregar_linha(linha)
+
+    def finalizar(self):
+        linha = self.__linha_pendente
+        self.__linha_pendente = ''
+
+        try:
+            self.__entregar_linha(linha)
+        except json.JSONDecodeError as erro:
+            raise ValueError('Incomplete JSON line.') from erro
+
+
+class GzipBase64StreamDecoder:
+    # Decodifica, em partes, uma saída no formato "gzip:<base64 do conteúdo compactado>",
+    # repassando o texto descompactado ao consumidor
+
+    PREFIXO = 'gzip:'
+
+    def __init__(self, consumidor):
+        self.__consumidor = consumidor
+        self.__descompactador = zlib.decompressobj(wbits=31)
+        self.__decodificador = codecs.getincrementaldecoder('utf-8')()
+        self.__base64_pendente = ''
+        self.__prefixo_lido = False
+
+    def __repassar(self, dados_descompactados, final=False):
+        texto = self.__decodificador.decode(dados_descompactados, final=final)
+        if texto:
+            self.__consumidor(texto)
+
+    def alimentar(self, texto):
+        texto = self.__base64_pendente + _REGEX_ESPACOS.sub('', texto)
+
+        if not self.__prefixo_lido:
+            if len(texto) < len(self.PREFIXO):
+                self.__base64_pendente = texto
+                return
+            if not texto.startswith(self.PREFIXO):
+                raise ValueError('Output is not compressed.')
+            texto = texto[len(self.PREFIXO):]
+            self.__prefixo_lido = True
+
+        # base64 é decodificado em grupos de 4 caracteres
+        tamanho_completo = len(texto) - len(texto) % 4
+        self.__base64_pendente = texto[tamanho_completo:]
+        self.__repassar(self.__descompactador.decompress(
+            base64.b64decode(texto[:tamanho_completo])))
+
+    def finalizar(self):
+        if self.__base64_pendente:
+            raise ValueError('Incomplete compressed output.')
+
+        if self.__prefixo_lido:
+            self.__repassar(self.__descompactador.flush(), final=True)
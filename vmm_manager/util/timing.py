@@ -0,0 +1,155 @@
+"""
+Time measurement of the commands executed on the access server.
+"""
+
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+ETAPA_CONEXAO = 'connect'
+ETAPA_SESSAO = 'session'
+ETAPA_ENVIO = 'upload'
+ETAPA_EXECUCAO = 'exec'
+ETAPA_DECODIFICACAO = 'decode'
+ETAPA_PROCESSAMENTO = 'parse'
+# Medida pelo próprio PowerShell: é parte do tempo de execução remota
+ETAPA_SERVIDOR = 'server'
+
+ETAPAS = [ETAPA_CONEXAO, ETAPA_SESSAO, ETAPA_ENVIO, ETAPA_EXECUCAO,
+          ETAPA_DECODIFICACAO, ETAPA_PROCESSAMENTO, ETAPA_SERVIDOR]
+
+
+class CommandTiming:
+
+    def __init__(self, comando):
+        self.comando = comando
+        self.tempos = dict.fromkeys(ETAPAS, 0.0)
+        self.total = 0.0
+
+    def adicionar(self, etapa, segundos):
+        self.tempos[etapa] += segundos
+
+    def get_tempo_etapas_locais(self):
+        return sum(tempo for etapa, tempo in self.tempos.items()
+                   if etapa != ETAPA_SERVIDOR)
+
+    def to_dict(self):
+        return {
+            'command': self.comando,
+            **{etapa: round(tempo * 1000, 1) for etapa, tempo in self.tempos.items()},
+            'total': round(self.total * 1000, 1),
+        }
+
+
+class TimingReport:
+    # Medições por comando; a etapa em andamento é associada ao comando da thread
+    # corrente, pois vários scripts podem ser executados ao mesmo tempo
+
+    def __init__(self):
+        self.medicoes = []
+        self.__lock = threading.Lock()
+        self.__medicao_atual = threading.local()
+
+    def __get_medicao_atual(self):
+        return getattr(self.__medicao_atual, 'valor', None)
+
+    @contextmanager
+    def medir_comando(self, comando):
+        medicao = CommandTiming(comando)
+        self.__medicao_atual.valor = medicao
+        inicio = time.perf_counter()
+        try:
+            yield medicao
+        finally:
+            medicao.total = time.perf_counter() - inicio
+            self.__medicao_atual.valor = None
+            with self.__lock:
+                self.medicoes.append(medicao)
+
+    @contextmanager
+    def medir(self, etapa):
+        # O tempo de etapas aninhadas não é contado duas vezes
+        medicao = self.__get_medicao_atual()
+        if not medicao:
+            yield
+            return
+
+        tempo_etapas_anterior = medicao.get_tempo_etapas_locais()
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            decorrido = time.perf_counter() - inicio
+            medicao.adicionar(etapa, decorrido - (
+                medicao.get_tempo_etapas_locais() - tempo_etapas_anterior))
+
+    def registrar(self, etapa, segundos):
+        medicao = self.__get_medicao_atual()
+        if medicao:
+            medicao.adicionar(etapa, segundos)
+
+    def get_dados(self):
+        with self.__lock:
+            return [medicao.to_dict() for medicao in self.medicoes]
+
+    def formatar(self):
+        dados = self.get_dados()
+        colunas = ETAPAS + ['total']
+        largura_comando = max([len('command')] + [len(item['command']) for item in dados])
+
+        linhas = ['Timings (ms):',
+                  f"{'command':<{largura_comando}} "
+                  + ' '.join(f'{coluna:>9}' for coluna in colunas)]
+        for item in dados + [TimingReport.__somar(dados, colunas)]:
+            linhas.append(f"{item['command']:<{largura_comando}} "
+                          + ' '.join(f'{item[coluna]:>9.1f}' for coluna in colunas))
+
+        return '\n'.join(linhas)
+
+    @staticmethod
+    def __somar(dados, colunas):
+        return {'command': 'TOTAL',
+                **{coluna: sum(item[coluna] for item in dados) for coluna in colunas}}
+
+
+class ServerTimingFilter:
+    # Remove da saída do script a linha com o tempo medido no servidor
+    # (template script_timing), repassando o restante ao consumidor
+    MARCADOR = '#vmm_manager-server-ms:'
+
+    __REGEX_TEMPO = re.compile(r'(\d+)')
+
+    def __init__(self, consumidor):
+        self.__consumidor = consumidor
+        self.__pendente = ''
+        self.tempo_servidor = None
+
+    def alimentar(self, texto):
+        self.__pendente += texto
+
+        inicio_marcador = self.__pendente.find(ServerTimingFilter.MARCADOR)
+        if inicio_marcador < 0:
+            # O final do texto pode ser o início do marcador
+            inicio_marcador = max(
+                0, len(self.__pendente) - len(ServerTimingFilter.MARCADOR) + 1)
+
+        if inicio_marcador:
+            self.__consumidor(self.__pendente[:inicio_marcador])
+            self.__pendente = self.__pendente[inicio_marcador:]
+
+    def finalizar(self):
+        texto = self.__pendente
+        self.__pendente = ''
+
+        if texto.startswith(ServerTimingFilter.MARCADOR):
+            tempo = ServerTimingFilter.__REGEX_TEMPO.search(
+                texto, len(ServerTimingFilter.MARCADOR))
+            if tempo:
+                self.tempo_servidor = int(tempo.group(1)) / 1000
+            texto = ''
+
+        if texto:
+            self.__consumidor(texto)
+
+        return self.tempo_servidor
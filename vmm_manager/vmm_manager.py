@@ -13,8 +13,11 @@ from ruamel.yaml import YAML, scanner
 
 from vmm_manager.entity.inventory import Inventory
 from vmm_manager.entity.plan import Plan
+from vmm_manager.entity.vm import VM
 from vmm_manager.infra.access_server import AccessServer
+from vmm_manager.infra.access_server_warmup import AccessServerWarmup
 from vmm_manager.infra.command import Command
+from vmm_manager.parser.inventory_cache import InventoryCache
 from vmm_manager.parser.parser_local import ParserLocal
 from vmm_manager.parser.parser_remote import ParserRemote
 from vmm_manager.util.config import (FIELD_GROUP, FIELD_ID, FIELD_IMAGE,
@@ -27,6 +30,7 @@ from vmm_manager.util.operation import (add_operation_lock,
                                         remove_operation_lock,
                                         validar_retorno_operacao_com_lock,
                                         validar_retorno_operacao_sem_lock)
+from vmm_manager.util.timing import TimingReport
 
 
 def parametro_arquivo_yaml(nome_arquivo):
@@ -53,6 +57,31 @@ def parametro_alfanumerico_limitado(value):
     return value
 
 
+def parametro_inteiro_positivo(value):
+    try:
+        valor_inteiro = int(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(
+            f"Invalid parameter: '{value}'") from exc
+
+    if valor_inteiro < 1:
+        raise argparse.ArgumentTypeError(
+            f"Invalid parameter: '{value}'. It must be greater than zero.")
+
+    return valor_inteiro
+
+
+def parametro_campos(value):
+    campos = [campo.strip().lower() for campo in value.split(',') if campo.strip()]
+    invalidos = [campo for campo in campos if campo not in VM.CAMPOS_JSON]
+
+    if not campos or invalidos:
+        raise argparse.ArgumentTypeError(
+            f"Invalid parameter: '{value}'. Valid fields: {', '.join(VM.CAMPOS_JSON)}.")
+
+    return campos
+
+
 def get_parser():
     parser = configargparse.ArgumentParser(
         description='''
@@ -83,15 +112,59 @@ def get_parser():
     parser.add('--no-color',
                help='Do not use colors in the output',
                env_var='VMM_NO_COLOR', required=False, action='store_true')
+    parser.add('--script-transport',
+               help='''
+                How the PowerShell scripts are sent to the access point: \
+                "stdin" streams them to a single PowerShell invocation (scripts \
+                too large, and template bodies run more than once, are uploaded \
+                and reused), "file" uploads them with SFTP first, \
+                "session" keeps one PowerShell process, with the VMM module loaded, \
+                for the whole execution
+               ''',
+               env_var='VMM_SCRIPT_TRANSPORT', required=False,
+               choices=AccessServer.MODOS_EXECUCAO, default=AccessServer.MODO_STDIN)
+    parser.add('--max-channels',
+               help='Maximum number of PowerShell scripts running at the same time on the access point',
+               env_var='VMM_MAX_CHANNELS', required=False,
+               type=parametro_inteiro_positivo, default=AccessServer.MAX_CANAIS_PADRAO)
+    parser.add('--compress',
+               help='''
+                Compress the data transferred from the access point: compact and \
+                gzipped JSON in the inventory queries, and SSH compression when \
+                supported by the server
+               ''',
+               env_var='VMM_COMPRESS', required=False, action='store_true')
+    parser.add('--connection-stats',
+               help='Show SSH connection statistics at the end of the execution',
+               env_var='VMM_CONNECTION_STATS', required=False, action='store_true')
+    parser.add('--timings',
+               help='''
+                Show, at the end of the execution, how long each PowerShell script \
+                took in each step: connection, upload, remote execution (and the time \
+                measured by PowerShell itself), decoding and parsing
+               ''',
+               env_var='VMM_TIMINGS', required=False, action='store_true')
+    parser.add('--inventory-cache',
+               help=f'''
+                Keep a local copy of the remote inventory of each group \
+                (in {InventoryCache.get_pasta_padrao()}): a quick query lists the \
+                last change of each VM, and only the VMs created or changed since \
+                the copy are loaded again
+               ''',
+               env_var='VMM_INVENTORY_CACHE', required=False, action='store_true')
 
     subprasers = parser.add_subparsers(dest='command')
     plan = subprasers.add_parser(
         'plan', help='Create an execution plan \
             based on the difference between the local and remote inventory')
     plan.add_argument('--inventory',
-                      help='YAML file with resource specifications',
+                      help=f'''
+                        YAML file with resource specifications. Repeat it to plan \
+                        several groups at once: each cloud is scanned only once and \
+                        one {Plan.get_arquivo_plano_grupo('<group>')} file is saved per group
+                      ''',
                       dest='inventory_file', env_var='VMM_INVENTORY',
-                      required=True, type=parametro_arquivo_yaml)
+                      required=True, type=parametro_arquivo_yaml, action='append')
 
     apply = subprasers.add_parser(
         'apply',
@@ -139,6 +212,9 @@ def get_parser():
     show.add_argument('--all-data',
                       help='Show all the resource data',
                       env_var='VMM_ALL_DATA', required=False, action='store_true')
+    show.add_argument('--fields',
+                      help='Comma-separated VM fields to show (the remote query computes only these)',
+                      env_var='VMM_FIELDS', required=False, type=parametro_campos)
 
     return parser
 
@@ -149,13 +225,15 @@ def obter_inventario_remoto(
     cloud,
     ocultar_progresso,
     filtro_nome_vm=None,
-    filtro_dados_completos=True
+    filtro_dados_completos=True,
+    cache_inventario=None,
+    campos=None
 ):
     imprimir_acao_corrente('Loading remote inventory', ocultar_progresso)
 
-    parser_remoto = ParserRemote(group, cloud)
+    parser_remoto = ParserRemote(group, cloud, cache_inventario)
     status, inventario_remoto = parser_remoto.get_inventario(
-        servidor_acesso, filtro_nome_vm, filtro_dados_completos)
+        servidor_acesso, filtro_nome_vm, filtro_dados_completos, campos)
     validar_retorno_operacao_com_lock(status, inventario_remoto,
                                       servidor_acesso, group,
                                       cloud, ocultar_progresso)
@@ -165,6 +243,7 @@ def obter_inventario_remoto(
 
 def obter_inventario_local(
     servidor_acesso,
+    preparacao_servidor,
     inventory_file,
     ocultar_progresso,
     filtro_nome_vm=None,
@@ -172,7 +251,16 @@ def obter_inventario_local(
 ):
     imprimir_acao_corrente('Loading local inventory', ocultar_progresso)
 
+    # Processamento local em paralelo com a preparação do servidor de acesso
     parser_local = ParserLocal(inventory_file)
+    status, inventario_local = parser_local.carregar_inventario(
+        filtro_nome_vm, filtro_dados_completos)
+    validar_retorno_operacao_sem_lock(
+        status, inventario_local, ocultar_progresso)
+
+    preparacao_servidor.aguardar(ocultar_progresso)
+
+    imprimir_acao_corrente('Validating local inventory', ocultar_progresso)
     status, inventario_local = parser_local.get_inventario(
         servidor_acesso, filtro_nome_vm, filtro_dados_completos)
     validar_retorno_operacao_sem_lock(
@@ -181,10 +269,12 @@ def obter_inventario_local(
     return inventario_local
 
 
-def obter_plano_execucao(servidor_acesso, inventario_local: Inventory, ocultar_progresso):
+def obter_plano_execucao(servidor_acesso, inventario_local: Inventory, ocultar_progresso,
+                         cache_inventario=None):
     inventario_remoto = obter_inventario_remoto(
         servidor_acesso, inventario_local.group,
-        inventario_local.cloud, ocultar_progresso)
+        inventario_local.cloud, ocultar_progresso,
+        cache_inventario=cache_inventario)
 
     imprimir_acao_corrente('Calculation execution plan', ocultar_progresso)
     status, plano_execucao = inventario_local.calcular_plano_execucao(
@@ -195,25 +285,32 @@ def obter_plano_execucao(servidor_acesso, inventario_local: Inventory, ocultar_p
     return plano_execucao
 
 
-def validar_conexao(servidor_acesso, ocultar_progresso):
-    imprimir_acao_corrente('Checking VMM connection', ocultar_progresso)
+def validar_conexao(servidor_acesso):
     cmd = Command('connection_test', vmm_server=servidor_acesso.vmm_server)
     status, msg = cmd.executar(servidor_acesso)
 
     if status and 'True' not in msg:
         status = False
-    validar_retorno_operacao_sem_lock(status, msg, ocultar_progresso)
+    return status, msg
 
 
-def vmm_setup(servidor_acesso, ocultar_progresso):
-    imprimir_acao_corrente('Setting up the VMM', ocultar_progresso)
+def vmm_setup(servidor_acesso):
     cmd = Command('vmm_setup', vmm_server=servidor_acesso.vmm_server,
                   campos_customizados=[FIELD_GROUP, FIELD_ID,
                                        FIELD_IMAGE, FIELD_REGION,
                                        FIELD_NETWORK_DEFAULT])
-    status, msg = cmd.executar(servidor_acesso)
+    return cmd.executar(servidor_acesso)
+
+
+def iniciar_preparacao_servidor(servidor_acesso, configurar_vmm):
+    # Conexão, teste de conexão e configuração do VMM em segundo plano
+    etapas = [('Checking VMM connection',
+               lambda: validar_conexao(servidor_acesso))]
+    if configurar_vmm:
+        etapas.append(('Setting up the VMM',
+                       lambda: vmm_setup(servidor_acesso)))
 
-    validar_retorno_operacao_sem_lock(status, msg, ocultar_progresso)
+    return AccessServerWarmup(etapas)
 
 
 def list_options(servidor_acesso, ocultar_progresso):
@@ -230,15 +327,18 @@ def list_options(servidor_acesso, ocultar_progresso):
 
 def imprimir_json_inventario(
     servidor_acesso,
+    preparacao_servidor,
     inventory_file,
     vm_name,
     all_data,
-    ocultar_progresso
+    ocultar_progresso,
+    cache_inventario=None,
+    campos=None
 ):
-    vmm_setup(servidor_acesso, ocultar_progresso)
+    dados_completos = all_data or 'additional_disks' in (campos or [])
     inventario_local = obter_inventario_local(
-        servidor_acesso, inventory_file, ocultar_progresso,
-        filtro_nome_vm=vm_name, filtro_dados_completos=all_data)
+        servidor_acesso, preparacao_servidor, inventory_file, ocultar_progresso,
+        filtro_nome_vm=vm_name, filtro_dados_completos=dados_completos)
 
     add_operation_lock(servidor_acesso, inventario_local.group,
                        inventario_local.cloud, ocultar_progresso)
@@ -246,23 +346,29 @@ def imprimir_json_inventario(
     inventario_remoto = obter_inventario_remoto(
         servidor_acesso, inventario_local.group,
         inventario_local.cloud, ocultar_progresso,
-        filtro_nome_vm=vm_name, filtro_dados_completos=all_data)
+        filtro_nome_vm=vm_name, filtro_dados_completos=dados_completos,
+        cache_inventario=cache_inventario, campos=campos)
 
     remove_operation_lock(servidor_acesso, inventario_local.group,
                           inventario_local.cloud, ocultar_progresso)
 
     imprimir_acao_corrente('Generating JSON', ocultar_progresso)
     status, json_inventario = Inventory.get_json(
-        inventario_local, inventario_remoto, all_data)
+        inventario_local, inventario_remoto, all_data, campos)
     validar_retorno_operacao_sem_lock(
         status, json_inventario, ocultar_progresso)
     print(json_inventario)
 
 
-def planejar_sincronizacao(servidor_acesso, inventory_file, ocultar_progresso):
-    vmm_setup(servidor_acesso, ocultar_progresso)
+def planejar_sincronizacao(
+    servidor_acesso,
+    preparacao_servidor,
+    inventory_file,
+    ocultar_progresso,
+    cache_inventario=None
+):
     inventario_local = obter_inventario_local(
-        servidor_acesso, inventory_file, ocultar_progresso)
+        servidor_acesso, preparacao_servidor, inventory_file, ocultar_progresso)
 
     add_operation_lock(servidor_acesso,
                        inventario_local.group,
@@ -270,7 +376,7 @@ def planejar_sincronizacao(servidor_acesso, inventory_file, ocultar_progresso):
 
     conteudo_arquivo = None
     plano_execucao = obter_plano_execucao(
-        servidor_acesso, inventario_local, ocultar_progresso)
+        servidor_acesso, inventario_local, ocultar_progresso, cache_inventario)
 
     if not plano_execucao.is_vazio():
         imprimir_acao_corrente(
@@ -291,16 +397,96 @@ def planejar_sincronizacao(servidor_acesso, inventory_file, ocultar_progresso):
             '\nNo differences between the local and remote inventory: nothing to do.')
 
 
+def calcular_planos_grupos(servidor_acesso, inventarios_locais, ocultar_progresso):
+    inventarios_por_nuvem = {}
+    for inventario_local in inventarios_locais:
+        inventarios_por_nuvem.setdefault(inventario_local.cloud, []).append(inventario_local)
+
+    planos_execucao = []
+    for cloud, inventarios_nuvem in inventarios_por_nuvem.items():
+        imprimir_acao_corrente(
+            f'Loading remote inventory of the cloud {cloud}', ocultar_progresso)
+        status, inventarios_remotos = ParserRemote.get_inventarios_nuvem(
+            servidor_acesso, cloud,
+            [inventario_local.group for inventario_local in inventarios_nuvem])
+        validar_retorno_operacao_sem_lock(
+            status, inventarios_remotos, ocultar_progresso)
+
+        for inventario_local in inventarios_nuvem:
+            imprimir_acao_corrente(
+                f'Calculation execution plan of the group {inventario_local.group}',
+                ocultar_progresso)
+            status, plano_execucao = inventario_local.calcular_plano_execucao(
+                inventarios_remotos[inventario_local.group])
+            validar_retorno_operacao_sem_lock(
+                status, plano_execucao, ocultar_progresso)
+            planos_execucao.append(plano_execucao)
+
+    return planos_execucao
+
+
+def planejar_sincronizacao_grupos(
+    servidor_acesso,
+    preparacao_servidor,
+    inventory_files,
+    ocultar_progresso
+):
+    # Um plano por grupo, a partir de uma única varredura de cada nuvem
+    inventarios_locais = [
+        obter_inventario_local(
+            servidor_acesso, preparacao_servidor, inventory_file, ocultar_progresso)
+        for inventory_file in inventory_files]
+
+    groups = [inventario_local.group.lower() for inventario_local in inventarios_locais]
+    if len(set(groups)) != len(groups):
+        finalizar_com_erro('Each inventory file must be of a different group.')
+
+    # Os locks adquiridos são liberados mesmo se algum passo falhar
+    inventarios_com_lock = []
+    planos_execucao = []
+    conteudos_arquivos = {}
+    try:
+        for inventario_local in inventarios_locais:
+            add_operation_lock(servidor_acesso, inventario_local.group,
+                               inventario_local.cloud, ocultar_progresso)
+            inventarios_com_lock.append(inventario_local)
+
+        planos_execucao = calcular_planos_grupos(
+            servidor_acesso, inventarios_locais, ocultar_progresso)
+
+        for plano_execucao in planos_execucao:
+            arquivo = Plan.get_arquivo_plano_grupo(plano_execucao.group)
+            if plano_execucao.is_vazio():
+                Plan.excluir_arquivo(arquivo)
+                continue
+
+            imprimir_acao_corrente(f'Saving file {arquivo}', ocultar_progresso)
+            status, conteudos_arquivos[arquivo] = plano_execucao.gerar_arquivo(arquivo)
+            validar_retorno_operacao_sem_lock(
+                status, conteudos_arquivos[arquivo], ocultar_progresso)
+    finally:
+        for inventario_local in inventarios_com_lock:
+            remove_operation_lock(servidor_acesso, inventario_local.group,
+                                  inventario_local.cloud, ocultar_progresso)
+
+    for arquivo, conteudo_arquivo in conteudos_arquivos.items():
+        print(f'\nChanges to apply ({arquivo}):\n{conteudo_arquivo}')
+    if len(conteudos_arquivos) < len(planos_execucao):
+        print('\nNo differences between the local and remote inventory of the groups: '
+              + ', '.join(plano_execucao.group for plano_execucao in planos_execucao
+                          if plano_execucao.is_vazio()))
+
+
 def executar_sincronizacao(
     servidor_acesso,
+    preparacao_servidor,
     execution_plan_file,
     skip_confirmation,
     inventory_file,
     ocultar_progresso,
-    interval_between_resources
+    interval_between_resources,
+    cache_inventario=None
 ):
-    vmm_setup(servidor_acesso, ocultar_progresso)
-
     # Obtendo plano de execução
     #
     # Caso de ter informado o plano de execução
@@ -312,13 +498,14 @@ def executar_sincronizacao(
             execution_plan_file or Plan.ARQUIVO_PLANO_EXECUCAO)
         validar_retorno_operacao_sem_lock(
             status, plano_execucao, ocultar_progresso)
+        preparacao_servidor.aguardar(ocultar_progresso)
     # Caso de ter informado o arquivo de inventário
     elif inventory_file:
         print(formatar_msg_aviso(
             'The execution plan will be generated based on the local inventory.'),
             flush=True)
         inventario_local = obter_inventario_local(
-            servidor_acesso, inventory_file, ocultar_progresso)
+            servidor_acesso, preparacao_servidor, inventory_file, ocultar_progresso)
 
         add_operation_lock(servidor_acesso, inventario_local.group,
                            inventario_local.cloud, ocultar_progresso)
@@ -327,7 +514,8 @@ def executar_sincronizacao(
         plano_execucao = obter_plano_execucao(
             servidor_acesso,
             inventario_local,
-            ocultar_progresso
+            ocultar_progresso,
+            cache_inventario
         )
     # Se não informou nem o plano nem o inventário, então informar erro
     else:
@@ -366,8 +554,6 @@ def remover_agrupamento_da_nuvem(
     skip_confirmation,
     ocultar_progresso
 ):
-    vmm_setup(servidor_acesso, ocultar_progresso)
-
     add_operation_lock(servidor_acesso, group, cloud, ocultar_progresso)
 
     inventario_remoto = obter_inventario_remoto(
@@ -405,26 +591,59 @@ def main():
     if not args.command:
         finalizar_com_erro('No command. Use -h for help.')
 
+    relatorio_tempos = TimingReport() if args.timings else None
     servidor_acesso = AccessServer(
-        args.access_point, args.username, args.password, args.server)
-    validar_conexao(servidor_acesso, args.hide_progress)
-
-    if args.command == 'plan':
+        args.access_point, args.username, args.password, args.server,
+        args.script_transport, args.max_channels, args.compress,
+        relatorio_tempos)
+    preparacao_servidor = iniciar_preparacao_servidor(
+        servidor_acesso, args.command != 'opts')
+    try:
+        executar_comando(servidor_acesso, preparacao_servidor, args)
+    finally:
+        if args.connection_stats:
+            print(f'\n{servidor_acesso.get_msg_estatisticas_conexao()}')
+        if relatorio_tempos:
+            print(f'\n{relatorio_tempos.formatar()}')
+        finalizar_servidor(servidor_acesso, preparacao_servidor)
+
+
+def finalizar_servidor(servidor_acesso, preparacao_servidor):
+    # Saída antecipada (ex.: inventário local inválido) com a preparação ainda em
+    # andamento: fechar esperaria a conexão terminar, então ela é abandonada
+    if preparacao_servidor.is_em_andamento():
+        preparacao_servidor.cancelar()
+        return
+    servidor_acesso.fechar()
+
+
+def executar_comando(servidor_acesso, preparacao_servidor, args):
+    cache_inventario = InventoryCache() if args.inventory_cache else None
+
+    if args.command == 'plan' and len(args.inventory_file) > 1:
+        planejar_sincronizacao_grupos(
+            servidor_acesso, preparacao_servidor,
+            args.inventory_file, args.hide_progress)
+    elif args.command == 'plan':
         planejar_sincronizacao(
-            servidor_acesso, args.inventory_file, args.hide_progress)
+            servidor_acesso, preparacao_servidor,
+            args.inventory_file[0], args.hide_progress, cache_inventario)
     elif args.command == 'apply':
         executar_sincronizacao(
-            servidor_acesso, args.execution_plan_file,
+            servidor_acesso, preparacao_servidor, args.execution_plan_file,
             args.skip_confirmation, args.inventory_file,
-            args.hide_progress, args.interval_between_resources)
+            args.hide_progress, args.interval_between_resources,
+            cache_inventario)
     elif args.command == 'destroy':
+        preparacao_servidor.aguardar(args.hide_progress)
         remover_agrupamento_da_nuvem(
             servidor_acesso, args.group, args.cloud,
             args.skip_confirmation, args.hide_progress)
     elif args.command == 'opts':
+        preparacao_servidor.aguardar(args.hide_progress)
         list_options(servidor_acesso, args.hide_progress)
     elif args.command == 'show':
         imprimir_json_inventario(
-            servidor_acesso, args.inventory_file,
+            servidor_acesso, preparacao_servidor, args.inventory_file,
             args.vm_name.upper(), args.all_data,
-            args.hide_progress)
+            args.hide_progress, cache_inventario, args.fields)